@@ -0,0 +1,87 @@
+import asyncio
+import hashlib
+import hmac
+import os
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from typing import TypeVar
+
+import bcrypt
+
+# bcrypt work factor; each increment doubles the hashing cost
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+_BCRYPT_PREFIXES = ("$2a$", "$2b$", "$2y$")
+
+# Dedicated pool so login storms queue up instead of spawning unbounded threads
+_hash_executor = ThreadPoolExecutor(
+    max_workers=os.cpu_count(), thread_name_prefix="password-hash"
+)
+
+T = TypeVar("T")
+
+
+async def run_in_hash_executor(func: Callable[..., T], *args) -> T:
+    """Run a CPU-bound password hashing call without blocking the event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_hash_executor, func, *args)
+
+
+def _encode(password: str) -> bytes:
+    """Encode a password for bcrypt, which only uses the first 72 bytes"""
+    return password.encode("utf-8")[:72]
+
+
+def hash_password(password: str) -> str:
+    """Hash a password with bcrypt"""
+    salt = bcrypt.gensalt(rounds=BCRYPT_ROUNDS)
+    return bcrypt.hashpw(_encode(password), salt).decode("ascii")
+
+
+def _verify_legacy_hash(password: str, hashed_password: str) -> bool:
+    """Verify a werkzeug-format "method$salt$hash" pbkdf2 or scrypt hash"""
+    try:
+        method, salt, expected = hashed_password.split("$", 2)
+    except ValueError:
+        return False
+
+    name, *params = method.split(":")
+    secret, salt_bytes = password.encode("utf-8"), salt.encode("utf-8")
+    try:
+        if name == "scrypt":
+            n, r, p = (int(value) for value in params) if params else (2**15, 8, 1)
+            actual = hashlib.scrypt(
+                secret, salt=salt_bytes, n=n, r=r, p=p, maxmem=132 * n * r * p
+            ).hex()
+        elif name == "pbkdf2":
+            hash_name = params[0] if params else "sha256"
+            iterations = int(params[1]) if len(params) > 1 else 1_000_000
+            actual = hashlib.pbkdf2_hmac(
+                hash_name, secret, salt_bytes, iterations
+            ).hex()
+        else:
+            return False
+    except ValueError:
+        return False
+
+    return secure_equals(actual, expected)
+
+
+def verify_password(password: str, hashed_password: str) -> bool:
+    """Verify a password against a bcrypt or legacy pbkdf2/scrypt hash"""
+    if hashed_password.startswith(_BCRYPT_PREFIXES):
+        return bcrypt.checkpw(_encode(password), hashed_password.encode("ascii"))
+    # Hashes created before the switch to bcrypt
+    return _verify_legacy_hash(password, hashed_password)
+
+
+def needs_rehash(hashed_password: str) -> bool:
+    """Check if a hash is legacy or uses a different bcrypt cost than configured"""
+    if not hashed_password.startswith(_BCRYPT_PREFIXES):
+        return True
+    return int(hashed_password[4:6]) != BCRYPT_ROUNDS
+
+
+def secure_equals(a: str, b: str) -> bool:
+    """Compare secret-derived strings in constant time"""
+    return hmac.compare_digest(a.encode("utf-8"), b.encode("utf-8"))
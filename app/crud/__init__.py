@@ -1,12 +1,15 @@
 from .analytics import (
+    bulk_create_click_analytics,
     cleanup_old_clicks,
     create_click_analytics,
     get_global_analytics_summary,
     get_url_analytics_summary,
     get_url_clicks,
     get_user_analytics_summary,
+    refresh_daily_click_stats,
 )
 from .url import (
+    add_click_counts,
     create_url,
     delete_url,
     delete_url_by_user,
@@ -16,6 +19,8 @@ from .url import (
     get_url_by_short_code,
     get_urls_by_user,
     increment_click_count,
+    resolve_and_count_click,
+    resolve_short_code,
     update_url,
 )
 from .user import (
@@ -34,8 +39,11 @@ __all__ = [
     # URL functions
     "create_url",
     "get_url_by_short_code",
+    "resolve_short_code",
+    "resolve_and_count_click",
     "get_url_by_id",
     "increment_click_count",
+    "add_click_counts",
     "get_urls_by_user",
     "get_url_by_id_and_user",
     "update_url",
@@ -54,9 +62,11 @@ __all__ = [
     "get_users",
     # Analytics functions
     "create_click_analytics",
+    "bulk_create_click_analytics",
     "get_url_clicks",
     "get_url_analytics_summary",
     "get_global_analytics_summary",
     "get_user_analytics_summary",
     "cleanup_old_clicks",
+    "refresh_daily_click_stats",
 ]
@@ -1,14 +1,102 @@
-from datetime import UTC, datetime, timedelta
-from typing import Optional
+import os
+from collections import Counter
+from collections.abc import Callable, Iterable
+from functools import lru_cache
+from datetime import UTC, date, datetime, time, timedelta
+from typing import Any, Optional, Union
 
 import user_agents
-from sqlalchemy import delete, func
+from sqlalchemy import (
+    ColumnElement,
+    Date,
+    DateTime,
+    Select,
+    String,
+    cast,
+    delete,
+    func,
+    insert,
+    literal_column,
+    null,
+    or_,
+    union_all,
+)
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
+from sqlalchemy.orm import load_only
 
-from app.models.analytics import URLClick
+from app.models.analytics import URLClick, URLClickDailyStats
+from app.models.url import URL
 from app.schemas.analytics import AnalyticsSummary
 
+ClickModel = Union[type[URLClick], type[URLClickDailyStats]]
+Scope = Callable[[Select, ClickModel], Select]
+
+# Distinct user agents whose parse results are kept in memory
+UA_CACHE_SIZE = int(os.getenv("UA_CACHE_SIZE", "50000"))
+
+
+def _day_start(day: date) -> datetime:
+    """Get the UTC start of a day."""
+    return datetime.combine(day, time.min, tzinfo=UTC)
+
+
+def _tag(kind: str) -> ColumnElement[str]:
+    """Inline constant tagging which aggregate a UNION ALL branch carries."""
+    return literal_column(f"'{kind}'", String)
+
+
+def _accumulate(
+    rows: Iterable[Any],
+    device_stats: Counter[str],
+    browser_stats: Counter[str],
+    daily_clicks: Counter[str],
+) -> None:
+    """Fold (day, device_type, browser, clicks) rows into the breakdowns."""
+    for day, device, browser, count in rows:
+        if device:
+            device_stats[device] += count
+        if browser:
+            browser_stats[browser] += count
+        daily_clicks[str(day)] += count
+
+
+@lru_cache(maxsize=UA_CACHE_SIZE)
+def _parse_ua(user_agent: str) -> tuple[str, Optional[str]]:
+    """
+    Parse a user agent into (device_type, browser).
+    Cached since a small set of user agents accounts for most traffic.
+    """
+    ua = user_agents.parse(user_agent)
+    device_type = (
+        "mobile" if ua.is_mobile else ("tablet" if ua.is_tablet else "desktop")
+    )
+    return device_type, ua.browser.family
+
+
+def _click_values(
+    url_id: int,
+    ip_address: Optional[str] = None,
+    user_agent: Optional[str] = None,
+    referrer: Optional[str] = None,
+) -> dict[str, Any]:
+    """
+    Build the column values for a click record, parsing the user agent.
+    """
+    # Parse user agent for additional info
+    device_type, browser = _parse_ua(user_agent) if user_agent else (None, None)
+
+    return {
+        "url_id": url_id,
+        "ip_address": ip_address,
+        "user_agent": user_agent,
+        "referrer": referrer,
+        "device_type": device_type,
+        "browser": browser,
+    }
+
 
 async def create_click_analytics(
     db: AsyncSession,
@@ -20,37 +108,61 @@ async def create_click_analytics(
     """
     Create a URL click analytics record.
     """
-    # Parse user agent for additional info
-    device_type = browser = None
-    if user_agent:
-        ua = user_agents.parse(user_agent)
-        device_type = (
-            "mobile" if ua.is_mobile else ("tablet" if ua.is_tablet else "desktop")
-        )
-        browser = ua.browser.family
-
-    db_click = URLClick(
-        url_id=url_id,
-        ip_address=ip_address,
-        user_agent=user_agent,
-        referrer=referrer,
-        device_type=device_type,
-        browser=browser,
-    )
+    db_click = URLClick(**_click_values(url_id, ip_address, user_agent, referrer))
     db.add(db_click)
     await db.commit()
-    await db.refresh(db_click)
     return db_click
 
 
+async def bulk_create_click_analytics(
+    db: AsyncSession, clicks: list[dict[str, Any]]
+) -> int:
+    """
+    Create many URL click analytics records in a single INSERT and commit.
+    Each click is a dict with url_id and optional ip_address, user_agent, referrer.
+    Returns the number of records created.
+    """
+    if not clicks:
+        return 0
+
+    await db.execute(
+        insert(URLClick),
+        [
+            _click_values(
+                click["url_id"],
+                click.get("ip_address"),
+                click.get("user_agent"),
+                click.get("referrer"),
+            )
+            for click in clicks
+        ],
+    )
+    await db.commit()
+    return len(clicks)
+
+
 async def get_url_clicks(
     db: AsyncSession, url_id: int, skip: int = 0, limit: int = 100
 ) -> list[URLClick]:
     """
     Get all clicks for a URL with pagination.
+    Only the columns exposed by URLClickResponse are loaded; the raw user agent
+    and city are deferred.
     """
     result = await db.execute(
         select(URLClick)
+        .options(
+            load_only(
+                URLClick.id,
+                URLClick.url_id,
+                URLClick.clicked_at,
+                URLClick.ip_address,
+                URLClick.referrer,
+                URLClick.device_type,
+                URLClick.browser,
+                URLClick.country,
+            )
+        )
         .where(URLClick.url_id == url_id)
         .offset(skip)
         .limit(limit)
@@ -59,183 +171,304 @@ async def get_url_clicks(
     return list(result.scalars().all())
 
 
-async def get_url_analytics_summary(
-    db: AsyncSession, url_id: int, days: int = 30
-) -> AnalyticsSummary:
-    """
-    Get analytics summary for a URL.
-    """
-    # Calculate date range
-    start_date = datetime.now(UTC) - timedelta(days=days)
+def _scope_to_url(url_id: int) -> Scope:
+    """Restrict a query to the clicks of a single URL."""
 
-    # Get total clicks
-    total_clicks_result = await db.execute(
-        select(func.count(URLClick.id)).where(URLClick.url_id == url_id)
-    )
-    total_clicks: int = total_clicks_result.scalar() or 0
+    def scope(stmt: Select, model: ClickModel) -> Select:
+        return stmt.where(model.url_id == url_id)
 
-    # Get clicks in date range
-    range_clicks_result = await db.execute(
-        select(func.count(URLClick.id)).where(
-            URLClick.url_id == url_id, URLClick.clicked_at >= start_date
-        )
-    )
-    range_clicks: int = range_clicks_result.scalar() or 0
+    return scope
 
-    # Get device type breakdown
-    device_result = await db.execute(
-        select(URLClick.device_type, func.count(URLClick.id))
-        .where(URLClick.url_id == url_id, URLClick.clicked_at >= start_date)
-        .group_by(URLClick.device_type)
-    )
-    device_stats = {device: count for device, count in device_result.all() if device}
 
-    # Get browser breakdown
-    browser_result = await db.execute(
-        select(URLClick.browser, func.count(URLClick.id))
-        .where(URLClick.url_id == url_id, URLClick.clicked_at >= start_date)
-        .group_by(URLClick.browser)
-    )
-    browser_stats = {
-        browser: count for browser, count in browser_result.all() if browser
-    }
+def _scope_to_user(user_id: int) -> Scope:
+    """Restrict a query to the clicks of all URLs owned by a user."""
 
-    # Get unique visitors (distinct IP addresses) in date range
-    unique_visitors_result = await db.execute(
-        select(func.count(func.distinct(URLClick.ip_address))).where(
-            URLClick.url_id == url_id, URLClick.clicked_at >= start_date
-        )
-    )
-    unique_visitors: int = unique_visitors_result.scalar() or 0
-
-    # Get referrer breakdown (top 10)
-    referrer_result = await db.execute(
-        select(URLClick.referrer, func.count(URLClick.id))
-        .where(
-            URLClick.url_id == url_id,
-            URLClick.clicked_at >= start_date,
-            URLClick.referrer.isnot(None),
-        )
-        .group_by(URLClick.referrer)
-        .order_by(func.count(URLClick.id).desc())
-        .limit(10)
-    )
-    referrer_stats = {ref: count for ref, count in referrer_result.all() if ref}
+    def scope(stmt: Select, model: ClickModel) -> Select:
+        return stmt.join(URL, URL.id == model.url_id).where(URL.user_id == user_id)
 
-    # Get daily click counts for the last 30 days
-    daily_clicks_result = await db.execute(
-        select(
-            func.date(URLClick.clicked_at).label("date"),
-            func.count(URLClick.id).label("count"),
-        )
-        .where(URLClick.url_id == url_id, URLClick.clicked_at >= start_date)
-        .group_by(func.date(URLClick.clicked_at))
-        .order_by("date")
-    )
-    daily_clicks = {str(date): count for date, count in daily_clicks_result.all()}
+    return scope
 
-    return AnalyticsSummary(
-        total_clicks=total_clicks,
-        clicks_in_range=range_clicks,
-        unique_visitors=unique_visitors,
-        date_range_days=days,
-        device_breakdown=device_stats,
-        browser_breakdown=browser_stats,
-        top_referrers=referrer_stats,
-        daily_clicks=daily_clicks,
-    )
 
+def _unscoped(stmt: Select, model: ClickModel) -> Select:
+    """Leave a query unrestricted (global analytics)."""
+    return stmt
 
-async def get_global_analytics_summary(
-    db: AsyncSession, days: int = 30
-) -> AnalyticsSummary:
+
+async def _rollup_watermark(db: AsyncSession) -> Optional[date]:
     """
-    Get global analytics summary (all URLs).
+    Get the first day not yet covered by the daily rollup.
+    Returns None if the rollup has never been refreshed.
     """
-    # Calculate date range
-    start_date = datetime.now(UTC) - timedelta(days=days)
+    result = await db.execute(select(func.max(URLClickDailyStats.day)))
+    last_day = result.scalar()
+    return last_day + timedelta(days=1) if last_day else None
 
-    # Get total clicks
-    total_clicks_result = await db.execute(select(func.count(URLClick.id)))
-    total_clicks: int = total_clicks_result.scalar() or 0
 
-    # Get clicks in date range
-    range_clicks_result = await db.execute(
-        select(func.count(URLClick.id)).where(URLClick.clicked_at >= start_date)
-    )
-    range_clicks: int = range_clicks_result.scalar() or 0
+async def refresh_daily_click_stats(
+    db: AsyncSession, since: Optional[date] = None
+) -> int:
+    """
+    Rebuild the daily click rollup for closed days from `since` up to yesterday.
+    Defaults to resuming from the current watermark.
+    Returns the number of rollup rows written.
+    """
+    today = datetime.now(UTC).date()
+    if since is None:
+        since = await _rollup_watermark(db)
+
+    if since is not None and since >= today:
+        return 0
 
-    # Get unique visitors (distinct IP addresses) in date range
-    unique_visitors_result = await db.execute(
-        select(func.count(func.distinct(URLClick.ip_address))).where(
-            URLClick.clicked_at >= start_date
+    day = func.date(URLClick.clicked_at)
+    source = (
+        select(
+            URLClick.url_id,
+            day,
+            URLClick.device_type,
+            URLClick.browser,
+            func.count(URLClick.id),
         )
+        .where(URLClick.clicked_at < _day_start(today))
+        .group_by(URLClick.url_id, day, URLClick.device_type, URLClick.browser)
     )
-    unique_visitors: int = unique_visitors_result.scalar() or 0
-
-    # Get device type breakdown
-    device_result = await db.execute(
-        select(URLClick.device_type, func.count(URLClick.id))
-        .where(URLClick.clicked_at >= start_date)
-        .group_by(URLClick.device_type)
+    stale = delete(URLClickDailyStats).where(URLClickDailyStats.day < today)
+    if since is not None:
+        source = source.where(URLClick.clicked_at >= _day_start(since))
+        stale = stale.where(URLClickDailyStats.day >= since)
+
+    # Upsert on the rollup key so a refresh overlapping another one for the same
+    # days overwrites its rows instead of inserting them a second time
+    upsert = pg_insert if db.get_bind().dialect.name == "postgresql" else sqlite_insert
+    stmt = upsert(URLClickDailyStats).from_select(
+        ["url_id", "day", "device_type", "browser", "clicks"], source
     )
-    device_stats = {device: count for device, count in device_result.all() if device}
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["url_id", "day", "device_type", "browser"],
+        set_={"clicks": stmt.excluded.clicks, "refreshed_at": func.now()},
+    )
+
+    await db.execute(stale)
+    result = await db.execute(stmt)
+    await db.commit()
+    return result.rowcount or 0
+
 
-    # Get browser breakdown
-    browser_result = await db.execute(
-        select(URLClick.browser, func.count(URLClick.id))
-        .where(URLClick.clicked_at >= start_date)
-        .group_by(URLClick.browser)
+async def _build_analytics_summary(
+    db: AsyncSession, scope: Scope, days: int, include_referrers: bool
+) -> AnalyticsSummary:
+    """
+    Build an analytics summary from the daily rollup for closed days plus the
+    raw clicks recorded after the rollup watermark, so results are never stale.
+    All aggregates are fetched in a single UNION ALL round-trip, one tagged
+    branch per aggregate. Every branch starts the range at UTC midnight `days` days
+    ago, the rollup's own day boundary, so results don't depend on whether the
+    rollup has run yet.
+    """
+    # Calculate date range
+    start_day = (datetime.now(UTC) - timedelta(days=days)).date()
+    start_date = _day_start(start_day)
+
+    # Raw clicks already folded into the rollup must not be counted twice
+    last_rolled_day = select(func.max(URLClickDailyStats.day)).scalar_subquery()
+    day = func.date(URLClick.clicked_at)
+    not_rolled_up = or_(last_rolled_day.is_(None), day > last_rolled_day)
+
+    no_day = cast(null(), Date)
+    no_label = cast(null(), String)
+    no_time = cast(null(), DateTime(timezone=True))
+    refreshed_at = (
+        select(func.max(URLClickDailyStats.refreshed_at))
+        .correlate(None)
+        .scalar_subquery()
     )
-    browser_stats = {
-        browser: count for browser, count in browser_result.all() if browser
-    }
 
-    # Get daily click counts for the last 30 days
-    daily_clicks_result = await db.execute(
-        select(
-            func.date(URLClick.clicked_at).label("date"),
-            func.count(URLClick.id).label("count"),
+    branches = [
+        # Total clicks (rollup + raw tail)
+        scope(
+            select(
+                _tag("total"),
+                no_day,
+                no_label,
+                no_label,
+                no_label,
+                refreshed_at,
+                func.sum(URLClickDailyStats.clicks),
+            ),
+            URLClickDailyStats,
+        ),
+        scope(
+            select(
+                _tag("total"),
+                no_day,
+                no_label,
+                no_label,
+                no_label,
+                no_time,
+                func.count(URLClick.id),
+            ),
+            URLClick,
+        ).where(not_rolled_up),
+        # Per day/device/browser clicks in date range (rollup + raw tail)
+        scope(
+            select(
+                _tag("daily"),
+                URLClickDailyStats.day,
+                URLClickDailyStats.device_type,
+                URLClickDailyStats.browser,
+                no_label,
+                no_time,
+                func.sum(URLClickDailyStats.clicks),
+            ),
+            URLClickDailyStats,
+        )
+        .where(URLClickDailyStats.day >= start_day)
+        .group_by(
+            URLClickDailyStats.day,
+            URLClickDailyStats.device_type,
+            URLClickDailyStats.browser,
+        ),
+        scope(
+            select(
+                _tag("daily"),
+                day,
+                URLClick.device_type,
+                URLClick.browser,
+                no_label,
+                no_time,
+                func.count(URLClick.id),
+            ),
+            URLClick,
+        )
+        .where(URLClick.clicked_at >= start_date, not_rolled_up)
+        .group_by(day, URLClick.device_type, URLClick.browser),
+        # Distinct IPs are not additive across days, so they come from the raw table
+        scope(
+            select(
+                _tag("unique"),
+                no_day,
+                no_label,
+                no_label,
+                no_label,
+                no_time,
+                func.count(func.distinct(URLClick.ip_address)),
+            ),
+            URLClick,
+        ).where(URLClick.clicked_at >= start_date),
+    ]
+
+    if include_referrers:
+        # Top 10 referrers; cardinality is too high to pre-aggregate
+        top_referrers = (
+            scope(
+                select(
+                    URLClick.referrer.label("referrer"),
+                    func.count(URLClick.id).label("clicks"),
+                ),
+                URLClick,
+            )
+            .where(URLClick.clicked_at >= start_date, URLClick.referrer.isnot(None))
+            .group_by(URLClick.referrer)
+            .order_by(func.count(URLClick.id).desc())
+            .limit(10)
+            .subquery()
+        )
+        branches.append(
+            select(
+                _tag("referrer"),
+                no_day,
+                no_label,
+                no_label,
+                top_referrers.c.referrer,
+                no_time,
+                top_referrers.c.clicks,
+            )
         )
-        .where(URLClick.clicked_at >= start_date)
-        .group_by(func.date(URLClick.clicked_at))
-        .order_by("date")
-    )
-    daily_clicks = {str(date): count for date, count in daily_clicks_result.all()}
+
+    result = await db.execute(union_all(*branches))
+
+    total_clicks = 0
+    unique_visitors = 0
+    last_refreshed_at = None
+    daily_rows = []
+    referrer_stats: dict[str, int] = {}
+    for kind, row_day, device, browser, referrer, refreshed, value in result.all():
+        value = int(value or 0)
+        if refreshed is not None:
+            last_refreshed_at = refreshed
+        if kind == "total":
+            total_clicks += value
+        elif kind == "daily":
+            daily_rows.append((row_day, device, browser, value))
+        elif kind == "unique":
+            unique_visitors = value
+        elif referrer:
+            referrer_stats[referrer] = value
+
+    device_stats: Counter[str] = Counter()
+    browser_stats: Counter[str] = Counter()
+    daily_clicks: Counter[str] = Counter()
+    _accumulate(daily_rows, device_stats, browser_stats, daily_clicks)
 
     return AnalyticsSummary(
         total_clicks=total_clicks,
-        clicks_in_range=range_clicks,
+        clicks_in_range=sum(daily_clicks.values()),
         unique_visitors=unique_visitors,
         date_range_days=days,
-        device_breakdown=device_stats,
-        browser_breakdown=browser_stats,
-        top_referrers={},  # Not relevant for global stats
-        daily_clicks=daily_clicks,
+        device_breakdown=dict(device_stats),
+        browser_breakdown=dict(browser_stats),
+        top_referrers=dict(
+            sorted(referrer_stats.items(), key=lambda item: item[1], reverse=True)
+        ),
+        daily_clicks=dict(sorted(daily_clicks.items())),
+        refreshed_at=last_refreshed_at,
     )
 
 
-async def cleanup_old_clicks(db: AsyncSession, days_to_keep: int = 90) -> int:
+async def get_url_analytics_summary(
+    db: AsyncSession, url_id: int, days: int = 30
+) -> AnalyticsSummary:
+    """
+    Get analytics summary for a URL.
+    """
+    return await _build_analytics_summary(
+        db, _scope_to_url(url_id), days, include_referrers=True
+    )
+
+
+async def get_global_analytics_summary(
+    db: AsyncSession, days: int = 30
+) -> AnalyticsSummary:
+    """
+    Get global analytics summary (all URLs).
+    Referrers are not relevant for global stats.
+    """
+    return await _build_analytics_summary(db, _unscoped, days, include_referrers=False)
+
+
+async def cleanup_old_clicks(
+    db: AsyncSession, days_to_keep: int = 90, batch_size: int = 10000
+) -> int:
     """
     Delete old click analytics data.
+    Deletes in batches of `batch_size`, committing each, to keep transactions short.
     Returns the number of records deleted.
     """
     cutoff_date = datetime.now(UTC) - timedelta(days=days_to_keep)
-
-    # First get the count of records to be deleted
-    count_stmt = select(func.count(URLClick.id)).where(
-        URLClick.clicked_at < cutoff_date
+    batch = (
+        select(URLClick.id)
+        .where(URLClick.clicked_at < cutoff_date)
+        .limit(batch_size)
+        .scalar_subquery()
     )
-    count_result = await db.execute(count_stmt)
-    count: int = count_result.scalar() or 0
 
-    # Only delete if there are records to delete
-    if count > 0:
-        stmt = delete(URLClick).where(URLClick.clicked_at < cutoff_date)
-        await db.execute(stmt)
+    total = 0
+    while True:
+        result = await db.execute(delete(URLClick).where(URLClick.id.in_(batch)))
         await db.commit()
-
-    return count
+        deleted = result.rowcount or 0
+        total += deleted
+        if deleted < batch_size:
+            return total
 
 
 async def get_user_analytics_summary(
@@ -243,74 +476,8 @@ async def get_user_analytics_summary(
 ) -> AnalyticsSummary:
     """
     Get analytics summary for all URLs owned by a user.
+    Referrers are not calculated for user-wide stats.
     """
-    # Calculate date range
-    start_date = datetime.now(UTC) - timedelta(days=days)
-
-    # Get total clicks for user's URLs
-    total_clicks_result = await db.execute(
-        select(func.count(URLClick.id))
-        .join(URLClick.url)
-        .where(URLClick.url.has(user_id=user_id))
-    )
-    total_clicks: int = total_clicks_result.scalar() or 0
-
-    # Get clicks in date range
-    range_clicks_result = await db.execute(
-        select(func.count(URLClick.id))
-        .join(URLClick.url)
-        .where(URLClick.url.has(user_id=user_id), URLClick.clicked_at >= start_date)
-    )
-    range_clicks: int = range_clicks_result.scalar() or 0
-
-    # Get unique visitors (distinct IP addresses) in date range
-    unique_visitors_result = await db.execute(
-        select(func.count(func.distinct(URLClick.ip_address)))
-        .join(URLClick.url)
-        .where(URLClick.url.has(user_id=user_id), URLClick.clicked_at >= start_date)
-    )
-    unique_visitors: int = unique_visitors_result.scalar() or 0
-
-    # Get device type breakdown
-    device_result = await db.execute(
-        select(URLClick.device_type, func.count(URLClick.id))
-        .join(URLClick.url)
-        .where(URLClick.url.has(user_id=user_id), URLClick.clicked_at >= start_date)
-        .group_by(URLClick.device_type)
-    )
-    device_stats = {device: count for device, count in device_result.all() if device}
-
-    # Get browser breakdown
-    browser_result = await db.execute(
-        select(URLClick.browser, func.count(URLClick.id))
-        .join(URLClick.url)
-        .where(URLClick.url.has(user_id=user_id), URLClick.clicked_at >= start_date)
-        .group_by(URLClick.browser)
-    )
-    browser_stats = {
-        browser: count for browser, count in browser_result.all() if browser
-    }
-
-    # Get daily click counts for the last 30 days
-    daily_clicks_result = await db.execute(
-        select(
-            func.date(URLClick.clicked_at).label("date"),
-            func.count(URLClick.id).label("count"),
-        )
-        .join(URLClick.url)
-        .where(URLClick.url.has(user_id=user_id), URLClick.clicked_at >= start_date)
-        .group_by(func.date(URLClick.clicked_at))
-        .order_by("date")
-    )
-    daily_clicks = {str(date): count for date, count in daily_clicks_result.all()}
-
-    return AnalyticsSummary(
-        total_clicks=total_clicks,
-        clicks_in_range=range_clicks,
-        unique_visitors=unique_visitors,
-        date_range_days=days,
-        device_breakdown=device_stats,
-        browser_breakdown=browser_stats,
-        top_referrers={},  # Not calculated for user-wide stats
-        daily_clicks=daily_clicks,
+    return await _build_analytics_summary(
+        db, _scope_to_user(user_id), days, include_referrers=False
     )
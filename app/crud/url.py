@@ -2,39 +2,64 @@ import secrets
 import string
 from typing import Optional
 
-from sqlalchemy import update
+from sqlalchemy import ColumnElement, case, delete, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
+from sqlalchemy.orm import raiseload
 
+from app.models.analytics import URLClick, URLClickDailyStats
 from app.models.url import URL
 from app.schemas.url import URLCreate
+from app.services import cache
+
+SHORT_CODE_ALPHABET = string.ascii_letters + string.digits
 
 
 def generate_short_code(length: int = 8) -> str:
-    """Generate a random short code for URLs."""
-    characters = string.ascii_letters + string.digits
-    return "".join(secrets.choice(characters) for _ in range(length))
+    """Generate a random base62 short code for URLs."""
+    # Draw uniformly from the whole code space (62**8 is ~2**47.6), then
+    # spell the number out in base62, left-padded to a fixed width
+    n = secrets.randbelow(len(SHORT_CODE_ALPHABET) ** length)
+    chars = []
+    for _ in range(length):
+        n, r = divmod(n, len(SHORT_CODE_ALPHABET))
+        chars.append(SHORT_CODE_ALPHABET[r])
+    return "".join(reversed(chars))
+
+
+# Attempts before giving up on finding a free short code
+MAX_SHORT_CODE_ATTEMPTS = 5
 
 
 async def create_url(
     db: AsyncSession, url_create: URLCreate, user_id: Optional[int] = None
 ) -> URL:
     """Create a new URL entry."""
-    short_code = generate_short_code()
-    # Ensure unique short code
-    while await get_url_by_short_code(db, short_code):
-        short_code = generate_short_code()
-
-    db_url = URL(
-        original_url=url_create.original_url,
-        short_code=short_code,
-        clicks=0,
-        user_id=user_id,
-    )
-    db.add(db_url)
-    await db.commit()
-    await db.refresh(db_url)
-    return db_url
+    insert = pg_insert if db.get_bind().dialect.name == "postgresql" else sqlite_insert
+    # Insert optimistically and let the unique index reject taken short codes,
+    # instead of probing with a SELECT first
+    for _ in range(MAX_SHORT_CODE_ATTEMPTS):
+        stmt = (
+            insert(URL)
+            .values(
+                original_url=url_create.original_url,
+                short_code=generate_short_code(),
+                clicks=0,
+                user_id=user_id,
+            )
+            .on_conflict_do_nothing(index_elements=["short_code"])
+            .returning(URL)
+        )
+        db_url = (await db.execute(stmt)).scalar_one_or_none()
+        if db_url:
+            await db.commit()
+            # Write through so the first redirect is already a cache hit
+            await cache.cache_url(db_url.short_code, db_url.id, db_url.original_url)
+            return db_url
+
+    raise RuntimeError("Could not generate a unique short code")
 
 
 async def get_url_by_short_code(db: AsyncSession, short_code: str) -> Optional[URL]:
@@ -43,6 +68,60 @@ async def get_url_by_short_code(db: AsyncSession, short_code: str) -> Optional[U
     return result.scalars().first()
 
 
+async def resolve_short_code(
+    db: AsyncSession, short_code: str
+) -> Optional[tuple[int, str]]:
+    """
+    Resolve a short code to (url_id, original_url) for redirects.
+    Served from the cache when possible, falling back to the database.
+    """
+    cached = await cache.get_cached_url(short_code)
+    if cached:
+        return cached["id"], cached["original_url"]
+
+    result = await db.execute(
+        select(URL.id, URL.original_url).where(URL.short_code == short_code)
+    )
+    row = result.first()
+    if row is None:
+        return None
+
+    await cache.cache_url(short_code, row.id, row.original_url)
+    return row.id, row.original_url
+
+
+async def resolve_and_count_click(
+    db: AsyncSession, short_code: str
+) -> Optional[tuple[int, str, bool]]:
+    """
+    Resolve a short code for a redirect as (url_id, original_url, counted).
+    Without Redis to buffer click counts, a cache miss counts the click in the
+    same UPDATE ... RETURNING that resolves it; otherwise counted is False and
+    the caller counts the click later.
+    """
+    if cache.get_client() is not None:
+        resolved = await resolve_short_code(db, short_code)
+        return (*resolved, False) if resolved else None
+
+    cached = await cache.get_cached_url(short_code)
+    if cached:
+        return cached["id"], cached["original_url"], False
+
+    result = await db.execute(
+        update(URL)
+        .where(URL.short_code == short_code)
+        .values(clicks=URL.clicks + 1)
+        .returning(URL.id, URL.original_url)
+    )
+    row = result.first()
+    await db.commit()
+    if row is None:
+        return None
+
+    await cache.cache_url(short_code, row.id, row.original_url)
+    return row.id, row.original_url, True
+
+
 async def get_url_by_id(db: AsyncSession, url_id: int) -> Optional[URL]:
     """Get URL by ID."""
     result = await db.execute(select(URL).where(URL.id == url_id))
@@ -51,24 +130,44 @@ async def get_url_by_id(db: AsyncSession, url_id: int) -> Optional[URL]:
 
 async def increment_click_count(db: AsyncSession, short_code: str) -> bool:
     """Increment click count for a URL."""
-    # Verify URL exists first
-    db_url = await get_url_by_short_code(db, short_code)
-    if not db_url:
-        return False
+    result = await db.execute(
+        update(URL)
+        .where(URL.short_code == short_code)
+        .values(clicks=URL.clicks + 1)
+        .returning(URL.id)
+    )
+    await db.commit()
+    return result.scalar_one_or_none() is not None
+
 
-    await db.execute(
-        update(URL).where(URL.short_code == short_code).values(clicks=URL.clicks + 1)
+async def add_click_counts(db: AsyncSession, deltas: dict[int, int]) -> int:
+    """
+    Add buffered click deltas to their URLs in a single UPDATE.
+    Returns the number of URLs updated.
+    """
+    if not deltas:
+        return 0
+
+    result = await db.execute(
+        update(URL)
+        .where(URL.id.in_(deltas))
+        .values(clicks=URL.clicks + case(deltas, value=URL.id, else_=0))
     )
     await db.commit()
-    return True
+    return result.rowcount
 
 
 async def get_urls_by_user(
     db: AsyncSession, user_id: int, skip: int = 0, limit: int = 100
 ) -> list[URL]:
     """Get URLs for a specific user with pagination."""
+    # Listings only need URL columns; fail loudly instead of lazy loading relationships
     result = await db.execute(
-        select(URL).where(URL.user_id == user_id).offset(skip).limit(limit)
+        select(URL)
+        .options(raiseload("*"))
+        .where(URL.user_id == user_id)
+        .offset(skip)
+        .limit(limit)
     )
     return list(result.scalars().all())
 
@@ -87,27 +186,42 @@ async def update_url(
     db: AsyncSession, url_id: int, user_id: int, url_update: URLCreate
 ) -> Optional[URL]:
     """Update a URL for a specific user."""
-    db_url = await get_url_by_id_and_user(db, url_id, user_id)
-    if not db_url:
-        return None
-
-    # Update using SQLAlchemy's update statement to avoid type issues
-    await db.execute(
-        update(URL).where(URL.id == url_id).values(original_url=url_update.original_url)
+    # Ownership check and update in one UPDATE ... RETURNING
+    result = await db.execute(
+        update(URL)
+        .where(URL.id == url_id, URL.user_id == user_id)
+        .values(original_url=url_update.original_url)
+        .returning(URL)
     )
+    db_url = result.scalar_one_or_none()
     await db.commit()
-    await db.refresh(db_url)
+    if db_url:
+        await cache.invalidate_url(db_url.short_code)
     return db_url
 
 
+async def _delete_urls_where(db: AsyncSession, *criteria: ColumnElement[bool]) -> bool:
+    """Delete the URL matching the criteria and its click data without loading them."""
+    url_ids = select(URL.id).where(*criteria)
+    # Bulk deletes bypass ORM cascades, so remove dependent rows first
+    for model in (URLClick, URLClickDailyStats):
+        await db.execute(
+            delete(model).where(model.url_id.in_(url_ids)),
+            execution_options={"synchronize_session": False},
+        )
+    result = await db.execute(delete(URL).where(*criteria).returning(URL.short_code))
+    short_code = result.scalar_one_or_none()
+    await db.commit()
+
+    if short_code is None:
+        return False
+    await cache.invalidate_url(short_code)
+    return True
+
+
 async def delete_url_by_user(db: AsyncSession, url_id: int, user_id: int) -> bool:
     """Delete a URL by ID and ensure it belongs to the user."""
-    db_url = await get_url_by_id_and_user(db, url_id, user_id)
-    if db_url:
-        await db.delete(db_url)
-        await db.commit()
-        return True
-    return False
+    return await _delete_urls_where(db, URL.id == url_id, URL.user_id == user_id)
 
 
 async def get_all_urls(db: AsyncSession, skip: int = 0, limit: int = 100) -> list[URL]:
@@ -118,9 +232,4 @@ async def get_all_urls(db: AsyncSession, skip: int = 0, limit: int = 100) -> lis
 
 async def delete_url(db: AsyncSession, url_id: int) -> bool:
     """Delete a URL by ID."""
-    db_url = await get_url_by_id(db, url_id)
-    if db_url:
-        await db.delete(db_url)
-        await db.commit()
-        return True
-    return False
+    return await _delete_urls_where(db, URL.id == url_id)
@@ -1,10 +1,13 @@
 from typing import Optional
 
+from sqlalchemy import case, or_
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy.orm import selectinload
+from sqlalchemy.orm import raiseload
+from sqlalchemy.orm.attributes import set_committed_value
 
 from app import models, schemas
+from app.core.security import needs_rehash, run_in_hash_executor
 
 
 async def get_user_by_username(
@@ -29,14 +32,24 @@ async def get_user_by_id(db: AsyncSession, user_id: int) -> Optional[models.User
     return result.scalars().first()
 
 
-async def get_user_with_urls(db: AsyncSession, user_id: int) -> Optional[models.User]:
-    """Get user with their URLs"""
+async def get_user_with_urls(
+    db: AsyncSession, user_id: int, skip: int = 0, limit: int = 100
+) -> Optional[models.User]:
+    """Get user with a page of their URLs in two queries, without lazy loads"""
+    db_user = await get_user_by_id(db, user_id)
+    if not db_user:
+        return None
+
     result = await db.execute(
-        select(models.User)
-        .where(models.User.id == user_id)
-        .options(selectinload(models.User.urls))
+        select(models.URL)
+        .options(raiseload("*"))
+        .where(models.URL.user_id == user_id)
+        .offset(skip)
+        .limit(limit)
     )
-    return result.scalars().first()
+    # Populate the relationship with just this page, without marking it dirty
+    set_committed_value(db_user, "urls", list(result.scalars().all()))
+    return db_user
 
 
 async def create_user(db: AsyncSession, user: schemas.UserCreate) -> models.User:
@@ -50,11 +63,11 @@ async def create_user(db: AsyncSession, user: schemas.UserCreate) -> models.User
         raise ValueError("Email already registered")
 
     db_user = models.User(username=user.username, email=user.email)
-    db_user.set_password(user.password)
+    # Hashing is CPU-bound; keep it off the event loop
+    await run_in_hash_executor(db_user.set_password, user.password)
 
     db.add(db_user)
     await db.commit()
-    await db.refresh(db_user)
     return db_user
 
 
@@ -62,12 +75,20 @@ async def authenticate_user(
     db: AsyncSession, username: str, password: str
 ) -> Optional[models.User]:
     """Authenticate a user with username/email and password"""
-    # Try to find user by username first, then by email
-    user = await get_user_by_username(db, username)
-    if not user:
-        user = await get_user_by_email(db, username)
+    # Match username or email in one query, preferring a username match
+    result = await db.execute(
+        select(models.User)
+        .where(or_(models.User.username == username, models.User.email == username))
+        .order_by(case((models.User.username == username, 0), else_=1))
+        .limit(1)
+    )
+    user = result.scalars().first()
 
-    if user and user.check_password(password):
+    if user and await run_in_hash_executor(user.check_password, password):
+        # Upgrade legacy or outdated hashes while the plain password is at hand
+        if needs_rehash(user.hashed_password):
+            await run_in_hash_executor(user.set_password, password)
+            await db.commit()
         return user
     return None
 
@@ -98,7 +119,7 @@ async def update_user(
     if user_update.email:
         db_user.email = user_update.email  # type: ignore
     if user_update.password:
-        db_user.set_password(user_update.password)
+        await run_in_hash_executor(db_user.set_password, user_update.password)
 
     await db.commit()
     await db.refresh(db_user)
@@ -1,6 +1,7 @@
 import os
 from typing import AsyncGenerator
 
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import DeclarativeBase
 
@@ -12,13 +13,54 @@ class Base(DeclarativeBase):
     pass
 
 
-# Create async engine
-engine = create_async_engine(DATABASE_URL, echo=False)
+IS_SQLITE = DATABASE_URL.startswith("sqlite")
+
+# Create async engine; SQLite has a single writer, so pool sizing only applies elsewhere
+engine_options = (
+    {}
+    if IS_SQLITE
+    else {
+        "pool_size": int(os.getenv("DB_POOL_SIZE", "20")),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "40")),
+        "pool_pre_ping": True,
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "300")),
+    }
+)
+if DATABASE_URL.startswith("postgresql+asyncpg"):
+    # Reuse prepared statements per connection, both in asyncpg and in the adapter.
+    # Sessions run in UTC so date() buckets clicks on the same days as the
+    # UTC cutoffs computed in Python.
+    engine_options["connect_args"] = {
+        "statement_cache_size": 1024,
+        "prepared_statement_cache_size": 1024,
+        "server_settings": {"timezone": "UTC"},
+    }
+# Compiled SQL is cached per statement shape; size it above the number of distinct queries
+engine = create_async_engine(
+    DATABASE_URL, echo=False, query_cache_size=1200, **engine_options
+)
+
+if IS_SQLITE:
+
+    @event.listens_for(engine.sync_engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+        """Let readers run alongside the writer and avoid an fsync per commit."""
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA cache_size=-64000")
+        cursor.close()
+
 
 # Create async session factory
 async_session = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
 
+def get_session_factory() -> async_sessionmaker[AsyncSession]:
+    """Dependency to get the session factory for work that outlives the request"""
+    return async_session
+
+
 async def get_db() -> AsyncGenerator[AsyncSession, None]:
     """Dependency to get database session"""
     async with async_session() as session:
@@ -25,9 +25,11 @@ class AnalyticsMiddleware(BaseHTTPMiddleware):
         # Log analytics for successful responses (2xx or redirects)
         if 200 <= response.status_code < 400:
             logger.info(
-                f"Request: {request.method} {request.url} "
-                f"Status: {response.status_code} "
-                f"User-Agent: {analytics_data.get('user_agent', 'Unknown')[:50]}"
+                "Request: %s %s Status: %s User-Agent: %.50s",
+                request.method,
+                request.url,
+                response.status_code,
+                analytics_data.get("user_agent", "Unknown"),
             )
 
         return response
@@ -1,6 +1,9 @@
 from .url import URL
 from .user import User
-from .analytics import URLClick
+from .analytics import URLClick, URLClickDailyStats
 from ..database import Base
 
-__all__ = ["URL", "User", "URLClick", "Base"]
+# Resolve relationships once all models are imported, instead of on first query
+Base.registry.configure()
+
+__all__ = ["URL", "User", "URLClick", "URLClickDailyStats", "Base"]
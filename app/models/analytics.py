@@ -1,7 +1,19 @@
-from datetime import datetime
+from datetime import date, datetime
 from typing import TYPE_CHECKING, Optional
 
-from sqlalchemy import DateTime, ForeignKey, Integer, String, Text, func
+from sqlalchemy import (
+    BigInteger,
+    Date,
+    DateTime,
+    ForeignKey,
+    Index,
+    Integer,
+    String,
+    Text,
+    UniqueConstraint,
+    func,
+    text,
+)
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from app.database import Base
@@ -12,6 +24,31 @@ if TYPE_CHECKING:
 
 class URLClick(Base):
     __tablename__ = "url_clicks"
+    __table_args__ = (
+        # Covering indexes so summary scans are served from index pages on PostgreSQL
+        Index(
+            "idx_urlclicks_urlid_clickedat",
+            "url_id",
+            "clicked_at",
+            postgresql_include=["device_type", "browser", "ip_address", "referrer"],
+        ),
+        Index(
+            "idx_urlclicks_clickedat",
+            "clicked_at",
+            postgresql_include=["device_type", "browser", "ip_address"],
+        ),
+        # Top referrers group only clicks that have one, straight off the index
+        Index(
+            "idx_urlclicks_urlid_referrer",
+            "url_id",
+            "referrer",
+            postgresql_include=["clicked_at"],
+            postgresql_where=text("referrer IS NOT NULL"),
+            sqlite_where=text("referrer IS NOT NULL"),
+        ),
+    )
+    # Fetch server defaults (id, timestamps) via INSERT ... RETURNING
+    __mapper_args__ = {"eager_defaults": True}
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
     url_id: Mapped[int] = mapped_column(Integer, ForeignKey("urls.id"), nullable=False)
@@ -34,3 +71,38 @@ class URLClick(Base):
 
     # Relationship to URL
     url: Mapped["URL"] = relationship("URL", back_populates="click_data")
+
+
+class URLClickDailyStats(Base):
+    """
+    Pre-aggregated click counts per URL, day, device type and browser.
+    Rebuilt from url_clicks for closed days by the rollup refresh job.
+    """
+
+    __tablename__ = "url_clicks_daily_stats"
+    __table_args__ = (
+        # One row per rollup key so overlapping refreshes upsert instead of
+        # duplicating; also serves the (url_id, day) lookups
+        UniqueConstraint(
+            "url_id",
+            "day",
+            "device_type",
+            "browser",
+            name="uq_url_clicks_daily_stats_key",
+            postgresql_nulls_not_distinct=True,
+        ),
+        Index("ix_url_clicks_daily_stats_day", "day"),
+    )
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    url_id: Mapped[int] = mapped_column(Integer, ForeignKey("urls.id"), nullable=False)
+    day: Mapped[date] = mapped_column(Date, nullable=False)
+    device_type: Mapped[Optional[str]] = mapped_column(String(20), nullable=True)
+    browser: Mapped[Optional[str]] = mapped_column(String(50), nullable=True)
+    clicks: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+    refreshed_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now()
+    )
+
+    # Relationship to URL
+    url: Mapped["URL"] = relationship("URL", back_populates="daily_stats")
@@ -1,18 +1,31 @@
 from datetime import datetime
 from typing import TYPE_CHECKING, Optional
 
-from sqlalchemy import DateTime, ForeignKey, Integer, String, func
+from sqlalchemy import DateTime, ForeignKey, Index, Integer, String, func
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from app.database import Base
 
 if TYPE_CHECKING:
-    from app.models.analytics import URLClick
+    from app.models.analytics import URLClick, URLClickDailyStats
     from app.models.user import User
 
 
 class URL(Base):
     __tablename__ = "urls"
+    __table_args__ = (
+        # Backs get_urls_by_user filtering and pagination
+        Index("ix_urls_user_id_id", "user_id", "id"),
+        # Index-only redirect lookups; PostgreSQL only, elsewhere it would just
+        # duplicate the unique short_code index
+        Index(
+            "ix_urls_short_code_covering",
+            "short_code",
+            postgresql_include=["original_url", "id"],
+        ).ddl_if(dialect="postgresql"),
+    )
+    # Fetch server defaults (id, timestamps) via INSERT ... RETURNING
+    __mapper_args__ = {"eager_defaults": True}
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
     original_url: Mapped[str] = mapped_column(String, nullable=False)
@@ -36,3 +49,8 @@ class URL(Base):
     click_data: Mapped[list["URLClick"]] = relationship(
         "URLClick", back_populates="url", cascade="all, delete-orphan"
     )
+
+    # Relationship to the pre-aggregated daily click rollup
+    daily_stats: Mapped[list["URLClickDailyStats"]] = relationship(
+        "URLClickDailyStats", back_populates="url", cascade="all, delete-orphan"
+    )
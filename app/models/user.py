@@ -3,8 +3,8 @@ from typing import TYPE_CHECKING
 
 from sqlalchemy import DateTime, Integer, String, func
 from sqlalchemy.orm import Mapped, mapped_column, relationship
-from werkzeug.security import check_password_hash, generate_password_hash
 
+from app.core.security import hash_password, verify_password
 from app.database import Base
 
 if TYPE_CHECKING:
@@ -13,6 +13,8 @@ if TYPE_CHECKING:
 
 class User(Base):
     __tablename__ = "users"
+    # Fetch server defaults (id, timestamps) via INSERT ... RETURNING
+    __mapper_args__ = {"eager_defaults": True}
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
     username: Mapped[str] = mapped_column(
@@ -36,11 +38,11 @@ class User(Base):
 
     def set_password(self, password: str):
         """Hash and set the user's password"""
-        self.hashed_password = generate_password_hash(password)
+        self.hashed_password = hash_password(password)
 
     def check_password(self, password: str) -> bool:
         """Verify the user's password"""
-        return check_password_hash(self.hashed_password, password)
+        return verify_password(password, self.hashed_password)
 
     def __repr__(self) -> str:
         return f"<User(username={self.username}, email={self.email})>"
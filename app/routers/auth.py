@@ -29,19 +29,13 @@ async def register_user(
     try:
         # Create the user
         db_user = await crud.create_user(db, user_data)
-        logger.info(f"User registered: {db_user.username}")
+        logger.info("User registered: %s", db_user.username)
         return db_user
 
     except ValueError as e:
         # Handle duplicate username/email
-        logger.warning(f"Registration failed: {str(e)}")
+        logger.warning("Registration failed: %s", e)
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
-    except Exception as e:
-        logger.error(f"Error registering user: {str(e)}")
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Internal server error",
-        )
 
 
 @router.post("/login", response_model=schemas.Token)
@@ -54,33 +48,23 @@ async def login_user(
     - **username**: Username or email address
     - **password**: User password
     """
-    try:
-        # Authenticate user
-        user = await crud.authenticate_user(db, form_data.username, form_data.password)
-
-        if not user:
-            logger.warning(f"Failed login attempt for: {form_data.username}")
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Incorrect username/email or password",
-                headers={"WWW-Authenticate": "Bearer"},
-            )
-
-        # Create access token
-        access_token = create_access_token(data={"sub": user.username})
-        logger.info(f"User logged in: {user.username}")
-
-        return {"access_token": access_token, "token_type": "bearer"}
-
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.error(f"Error during login: {str(e)}")
+    # Authenticate user
+    user = await crud.authenticate_user(db, form_data.username, form_data.password)
+
+    if not user:
+        logger.warning("Failed login attempt for: %s", form_data.username)
         raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Internal server error",
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Incorrect username/email or password",
+            headers={"WWW-Authenticate": "Bearer"},
         )
 
+    # Create access token
+    access_token = create_access_token(data={"sub": user.username})
+    logger.info("User logged in: %s", user.username)
+
+    return {"access_token": access_token, "token_type": "bearer"}
+
 
 @router.get("/me", response_model=schemas.UserResponse)
 async def get_current_user_profile(
@@ -91,40 +75,29 @@ async def get_current_user_profile(
 
     Requires authentication.
     """
-    try:
-        return current_user
-    except Exception as e:
-        logger.error(f"Error getting user profile: {str(e)}")
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Internal server error",
-        )
+    return current_user
 
 
 @router.get("/me/urls", response_model=schemas.UserWithUrls)
 async def get_current_user_urls(
+    skip: int = 0,
+    limit: int = 100,
     current_user: models.User = Depends(get_current_active_user),
     db: AsyncSession = Depends(get_db),
 ):
     """
     Get current user's URLs with details.
 
-    Requires authentication.
+    - **skip**: Number of URLs to skip (pagination)
+    - **limit**: Maximum number of URLs to return (pagination)
+    - Requires authentication
     """
-    try:
-        # Get user with their URLs loaded
-        user_with_urls = await crud.get_user_with_urls(db, current_user.id)
-        if not user_with_urls:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND, detail="User not found"
-            )
-        return user_with_urls
-
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.error(f"Error getting user URLs: {str(e)}")
+    # Get user with their URLs loaded
+    user_with_urls = await crud.get_user_with_urls(
+        db, current_user.id, skip=skip, limit=limit
+    )
+    if not user_with_urls:
         raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Internal server error",
+            status_code=status.HTTP_404_NOT_FOUND, detail="User not found"
         )
+    return user_with_urls
@@ -1,12 +1,14 @@
 import logging
 
-from fastapi import APIRouter, Depends, HTTPException, Request, status
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Request, status
 from fastapi.responses import RedirectResponse
-from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 
 from app import crud, models, schemas
 from app.core.auth import get_current_active_user
-from app.database import get_db
+from app.database import get_db, get_session_factory
+from app.services.click_counter import count_click, pending_click_count
+from app.services.click_queue import enqueue_click
 
 router = APIRouter(tags=["URL Shortener"])
 logger = logging.getLogger(__name__)
@@ -24,21 +26,18 @@ async def create_short_url(
     - **original_url**: The URL to shorten (must be valid)
     - Returns the shortened URL information
     """
-    try:
-        db_url = await crud.create_url(db, url_create)
-        logger.info(f"Created short URL: {db_url.short_code}")
-        return db_url
-    except Exception as e:
-        logger.error(f"Error creating short URL: {str(e)}")
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Internal server error",
-        )
+    db_url = await crud.create_url(db, url_create)
+    logger.info("Created short URL: %s", db_url.short_code)
+    return db_url
 
 
 @router.get("/{short_code}")
 async def redirect_to_url(
-    short_code: str, request: Request, db: AsyncSession = Depends(get_db)
+    short_code: str,
+    request: Request,
+    background_tasks: BackgroundTasks,
+    db: AsyncSession = Depends(get_db),
+    session_factory: async_sessionmaker[AsyncSession] = Depends(get_session_factory),
 ):
     """
     Redirect to the original URL.
@@ -46,41 +45,34 @@ async def redirect_to_url(
     - **short_code**: The short code from the shortened URL
     - Redirects to the original URL or returns 404 if not found
     """
-    try:
-        db_url = await crud.get_url_by_short_code(db, short_code)
-        if db_url is None:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND, detail="URL not found"
-            )
-
-        # Get analytics data from middleware
-        analytics_data = getattr(request.state, "analytics_data", {})
-
-        # Create analytics record for the click
-        await crud.create_click_analytics(
-            db=db,
-            url_id=db_url.id,
-            ip_address=analytics_data.get("ip_address"),
-            user_agent=analytics_data.get("user_agent"),
-            referrer=analytics_data.get("referrer"),
+    resolved = await crud.resolve_and_count_click(db, short_code)
+    if resolved is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="URL not found"
         )
+    url_id, original_url, counted = resolved
 
-        # Increment click count (legacy support)
-        await crud.increment_click_count(db, short_code)
-        logger.info(f"Redirecting {short_code} to {db_url.original_url}")
+    # Get analytics data from middleware
+    analytics_data = getattr(request.state, "analytics_data", {})
 
-        return RedirectResponse(
-            url=db_url.original_url, status_code=status.HTTP_302_FOUND
-        )
+    # Queue the click for the background analytics writer
+    enqueue_click(
+        {
+            "url_id": url_id,
+            "ip_address": analytics_data.get("ip_address"),
+            "user_agent": analytics_data.get("user_agent"),
+            "referrer": analytics_data.get("referrer"),
+        }
+    )
 
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.error(f"Error redirecting URL: {str(e)}")
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Internal server error",
-        )
+    # Count the click once the redirect has been sent, unless resolving it
+    # already did
+    if not counted:
+        background_tasks.add_task(count_click, url_id, session_factory)
+
+    logger.info("Redirecting %s to %s", short_code, original_url)
+
+    return RedirectResponse(url=original_url, status_code=status.HTTP_302_FOUND)
 
 
 @router.get("/stats/{short_code}", response_model=schemas.URLStats)
@@ -91,24 +83,29 @@ async def get_url_stats(short_code: str, db: AsyncSession = Depends(get_db)):
     - **short_code**: The short code from the shortened URL
     - Returns URL statistics or 404 if not found
     """
-    try:
-        db_url = await crud.get_url_by_short_code(db, short_code)
-        if db_url is None:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND, detail="URL not found"
-            )
-
-        return db_url
-
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.error(f"Error getting URL stats: {str(e)}")
+    db_url = await crud.get_url_by_short_code(db, short_code)
+    if db_url is None:
         raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Internal server error",
+            status_code=status.HTTP_404_NOT_FOUND, detail="URL not found"
         )
 
+    # Include clicks still buffered in Redis
+    stats = schemas.URLStats.model_validate(db_url)
+    stats.clicks += await pending_click_count(db_url.id)
+    return stats
+
+
+@router.get("/analytics/global", response_model=schemas.AnalyticsSummary)
+async def get_global_analytics(days: int = 30, db: AsyncSession = Depends(get_db)):
+    """
+    Get global analytics for all URLs.
+
+    - **days**: Number of days to look back (default: 30)
+    - Returns global analytics statistics
+    """
+    analytics = await crud.get_global_analytics_summary(db, days=days)
+    return analytics
+
 
 @router.get("/analytics/{short_code}", response_model=schemas.AnalyticsSummary)
 async def get_url_analytics(
@@ -121,44 +118,14 @@ async def get_url_analytics(
     - **days**: Number of days to look back (default: 30)
     - Returns detailed analytics including device/browser breakdown
     """
-    try:
-        db_url = await crud.get_url_by_short_code(db, short_code)
-        if db_url is None:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND, detail="URL not found"
-            )
-
-        analytics = await crud.get_url_analytics_summary(db, db_url.id, days=days)
-        return analytics
-
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.error(f"Error getting URL analytics: {str(e)}")
+    db_url = await crud.get_url_by_short_code(db, short_code)
+    if db_url is None:
         raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Internal server error",
+            status_code=status.HTTP_404_NOT_FOUND, detail="URL not found"
         )
 
-
-@router.get("/analytics/global", response_model=schemas.AnalyticsSummary)
-async def get_global_analytics(days: int = 30, db: AsyncSession = Depends(get_db)):
-    """
-    Get global analytics for all URLs.
-
-    - **days**: Number of days to look back (default: 30)
-    - Returns global analytics statistics
-    """
-    try:
-        analytics = await crud.get_global_analytics_summary(db, days=days)
-        return analytics
-
-    except Exception as e:
-        logger.error(f"Error getting global analytics: {str(e)}")
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Internal server error",
-        )
+    analytics = await crud.get_url_analytics_summary(db, db_url.id, days=days)
+    return analytics
 
 
 # User-specific endpoints (require authentication)
@@ -181,18 +148,11 @@ async def create_user_short_url(
     - Requires authentication
     - Returns the shortened URL information associated with the user
     """
-    try:
-        db_url = await crud.create_url(db, url_create, current_user.id)
-        logger.info(
-            f"User {current_user.username} created short URL: {db_url.short_code}"
-        )
-        return db_url
-    except Exception as e:
-        logger.error(f"Error creating user short URL: {str(e)}")
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Internal server error",
-        )
+    db_url = await crud.create_url(db, url_create, current_user.id)
+    logger.info(
+        "User %s created short URL: %s", current_user.username, db_url.short_code
+    )
+    return db_url
 
 
 @router.get("/user/urls", response_model=list[schemas.URLResponse])
@@ -210,15 +170,8 @@ async def get_user_urls(
     - Requires authentication
     - Returns list of user's URLs
     """
-    try:
-        urls = await crud.get_urls_by_user(db, current_user.id, skip=skip, limit=limit)
-        return urls
-    except Exception as e:
-        logger.error(f"Error getting user URLs: {str(e)}")
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Internal server error",
-        )
+    urls = await crud.get_urls_by_user(db, current_user.id, skip=skip, limit=limit)
+    return urls
 
 
 @router.get("/user/urls/{url_id}", response_model=schemas.URLResponse)
@@ -234,21 +187,12 @@ async def get_user_url(
     - Requires authentication
     - Only returns URLs owned by the authenticated user
     """
-    try:
-        db_url = await crud.get_url_by_id_and_user(db, url_id, current_user.id)
-        if db_url is None:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND, detail="URL not found"
-            )
-        return db_url
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.error(f"Error getting user URL: {str(e)}")
+    db_url = await crud.get_url_by_id_and_user(db, url_id, current_user.id)
+    if db_url is None:
         raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Internal server error",
+            status_code=status.HTTP_404_NOT_FOUND, detail="URL not found"
         )
+    return db_url
 
 
 @router.put("/user/urls/{url_id}", response_model=schemas.URLResponse)
@@ -266,22 +210,13 @@ async def update_user_url(
     - Requires authentication
     - Only allows updating URLs owned by the authenticated user
     """
-    try:
-        db_url = await crud.update_url(db, url_id, current_user.id, url_update)
-        if db_url is None:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND, detail="URL not found"
-            )
-        logger.info(f"User {current_user.username} updated URL {url_id}")
-        return db_url
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.error(f"Error updating user URL: {str(e)}")
+    db_url = await crud.update_url(db, url_id, current_user.id, url_update)
+    if db_url is None:
         raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Internal server error",
+            status_code=status.HTTP_404_NOT_FOUND, detail="URL not found"
         )
+    logger.info("User %s updated URL %s", current_user.username, url_id)
+    return db_url
 
 
 @router.delete("/user/urls/{url_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -297,19 +232,10 @@ async def delete_user_url(
     - Requires authentication
     - Only allows deleting URLs owned by the authenticated user
     """
-    try:
-        success = await crud.delete_url_by_user(db, url_id, current_user.id)
-        if not success:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND, detail="URL not found"
-            )
-        logger.info(f"User {current_user.username} deleted URL {url_id}")
-        return
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.error(f"Error deleting user URL: {str(e)}")
+    success = await crud.delete_url_by_user(db, url_id, current_user.id)
+    if not success:
         raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Internal server error",
+            status_code=status.HTTP_404_NOT_FOUND, detail="URL not found"
         )
+    logger.info("User %s deleted URL %s", current_user.username, url_id)
+    return
@@ -13,6 +13,7 @@ class AnalyticsSummary(BaseModel):
     browser_breakdown: Dict[str, int]  # browser: count
     top_referrers: Dict[str, int]  # referrer: count
     daily_clicks: Dict[str, int]  # date: count
+    refreshed_at: Optional[datetime] = None  # last daily rollup refresh
 
     model_config = ConfigDict(from_attributes=True)
 
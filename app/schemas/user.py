@@ -1,4 +1,5 @@
 import re
+import string
 from datetime import datetime
 from typing import Optional
 
@@ -6,6 +7,36 @@ from pydantic import BaseModel, ConfigDict, EmailStr, Field, field_validator
 
 from .url import URLResponse
 
+# Compiled once at import instead of looked up in re's cache on every validation
+_USERNAME_RE = re.compile(r"^[a-zA-Z0-9_-]+$")
+
+# Password character classes as bit flags, looked up per byte in a single pass
+_UPPER, _LOWER, _DIGIT, _SPECIAL = 1, 2, 4, 8
+_ALL_CLASSES = _UPPER | _LOWER | _DIGIT | _SPECIAL
+
+
+def _build_char_classes() -> bytes:
+    """Map each byte to its password character class flag"""
+    table = bytearray(256)
+    for chars, flag in (
+        (string.ascii_uppercase, _UPPER),
+        (string.ascii_lowercase, _LOWER),
+        (string.digits, _DIGIT),
+        ('!@#$%^&*(),.?":{}|<>', _SPECIAL),
+    ):
+        for char in chars:
+            table[ord(char)] = flag
+    return bytes(table)
+
+
+_CHAR_CLASSES = _build_char_classes()
+_PASSWORD_RULES = (
+    (_UPPER, "Password must contain at least one uppercase letter"),
+    (_LOWER, "Password must contain at least one lowercase letter"),
+    (_DIGIT, "Password must contain at least one digit"),
+    (_SPECIAL, "Password must contain at least one special character"),
+)
+
 
 class UserBase(BaseModel):
     username: str = Field(
@@ -23,7 +54,7 @@ class UserCreate(UserBase):
     @classmethod
     def validate_username(cls, v: str) -> str:
         """Validate username format"""
-        if not re.match(r"^[a-zA-Z0-9_-]+$", v):
+        if not _USERNAME_RE.match(v):
             raise ValueError(
                 "Username can only contain letters, numbers, underscores, and hyphens"
             )
@@ -35,14 +66,15 @@ class UserCreate(UserBase):
     @classmethod
     def validate_password(cls, v: str) -> str:
         """Validate password strength"""
-        if not re.search(r"[A-Z]", v):
-            raise ValueError("Password must contain at least one uppercase letter")
-        if not re.search(r"[a-z]", v):
-            raise ValueError("Password must contain at least one lowercase letter")
-        if not re.search(r"[0-9]", v):
-            raise ValueError("Password must contain at least one digit")
-        if not re.search(r'[!@#$%^&*(),.?":{}|<>]', v):
-            raise ValueError("Password must contain at least one special character")
+        seen = 0
+        for byte in v.encode():
+            seen |= _CHAR_CLASSES[byte]
+            if seen == _ALL_CLASSES:
+                return v
+
+        for flag, message in _PASSWORD_RULES:
+            if not seen & flag:
+                raise ValueError(message)
         return v
 
 
@@ -0,0 +1,33 @@
+import asyncio
+import logging
+import os
+
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app import crud
+from app.database import async_session
+
+logger = logging.getLogger(__name__)
+
+# How often to roll closed days of raw clicks into url_clicks_daily_stats
+ROLLUP_INTERVAL_SECONDS = float(os.getenv("ANALYTICS_ROLLUP_INTERVAL_SECONDS", "300"))
+
+
+async def run_daily_rollup(
+    session_factory: async_sessionmaker[AsyncSession] = async_session,
+    interval: float = ROLLUP_INTERVAL_SECONDS,
+) -> None:
+    """
+    Periodically refresh the daily click rollup.
+    Each pass resumes from the rollup watermark, so it is a no-op until a day closes.
+    """
+    while True:
+        try:
+            async with session_factory() as db:
+                rows = await crud.refresh_daily_click_stats(db)
+            if rows:
+                logger.info("Daily click rollup refreshed: %s rows", rows)
+        except Exception as e:
+            logger.error("Error refreshing daily click rollup: %s", e)
+
+        await asyncio.sleep(interval)
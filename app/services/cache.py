@@ -0,0 +1,167 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from collections.abc import Callable
+from typing import Any, Optional
+
+try:
+    import redis.asyncio as redis
+except ImportError:  # pragma: no cover - redis is optional
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+# Redis-backed features are disabled unless a Redis URL is configured
+REDIS_URL = os.getenv("REDIS_URL")
+# How long a resolved short code stays cached
+URL_CACHE_TTL_SECONDS = int(os.getenv("URL_CACHE_TTL_SECONDS", "3600"))
+# Per-process cache in front of Redis; a size of 0 disables it
+URL_LOCAL_CACHE_SIZE = int(os.getenv("URL_LOCAL_CACHE_SIZE", "10000"))
+URL_LOCAL_CACHE_TTL_SECONDS = float(os.getenv("URL_LOCAL_CACHE_TTL_SECONDS", "300"))
+# Pub/sub channel telling other workers to drop a short code from their local cache
+INVALIDATION_CHANNEL = "url-cache-invalidate"
+
+_client: Optional[Any] = None
+
+
+class TTLCache:
+    """
+    Small in-process LRU cache whose entries expire after a fixed TTL.
+    """
+
+    def __init__(
+        self, maxsize: int, ttl: float, clock: Callable[[], float] = time.monotonic
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self._entries: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        expires_at, value = entry
+        if expires_at < self.clock():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any) -> None:
+        if self.maxsize <= 0:
+            return
+
+        self._entries[key] = (self.clock() + self.ttl, value)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def pop(self, key: str) -> None:
+        self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+_local_urls = TTLCache(URL_LOCAL_CACHE_SIZE, URL_LOCAL_CACHE_TTL_SECONDS)
+
+
+def get_client() -> Optional[Any]:
+    """Get the shared Redis client, or None if Redis is not configured."""
+    global _client
+    if _client is None and REDIS_URL and redis is not None:
+        _client = redis.from_url(REDIS_URL, decode_responses=True)
+    return _client
+
+
+def _url_key(short_code: str) -> str:
+    return f"u:{short_code}"
+
+
+async def get_cached_url(short_code: str) -> Optional[dict[str, Any]]:
+    """
+    Get the cached {"id", "original_url"} for a short code, checking the local
+    cache before Redis.
+    Returns None on a miss or if Redis is unavailable.
+    """
+    cached = _local_urls.get(short_code)
+    if cached is not None:
+        return cached
+
+    client = get_client()
+    if client is None:
+        return None
+
+    try:
+        raw = await client.get(_url_key(short_code))
+    except Exception as e:
+        logger.warning("Error reading URL cache: %s", e)
+        return None
+    if not raw:
+        return None
+
+    cached = json.loads(raw)
+    _local_urls.set(short_code, cached)
+    return cached
+
+
+async def cache_url(short_code: str, url_id: int, original_url: str) -> None:
+    """Cache the redirect target for a short code."""
+    _local_urls.set(short_code, {"id": url_id, "original_url": original_url})
+
+    client = get_client()
+    if client is None:
+        return
+
+    try:
+        await client.set(
+            _url_key(short_code),
+            json.dumps({"id": url_id, "original_url": original_url}),
+            ex=URL_CACHE_TTL_SECONDS,
+        )
+    except Exception as e:
+        logger.warning("Error writing URL cache: %s", e)
+
+
+async def invalidate_url(short_code: str) -> None:
+    """Drop a short code from the cache after its URL changes or is deleted."""
+    _local_urls.pop(short_code)
+
+    client = get_client()
+    if client is None:
+        return
+
+    try:
+        await client.delete(_url_key(short_code))
+        await client.publish(INVALIDATION_CHANNEL, short_code)
+    except Exception as e:
+        logger.warning("Error invalidating URL cache: %s", e)
+
+
+async def run_invalidation_listener(retry_interval: float = 5) -> None:
+    """
+    Evict short codes invalidated by other workers from the local cache.
+    Does nothing if Redis is not configured.
+    """
+    client = get_client()
+    if client is None:
+        return
+
+    while True:
+        try:
+            async with client.pubsub() as pubsub:
+                await pubsub.subscribe(INVALIDATION_CHANNEL)
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        _local_urls.pop(message["data"])
+        except Exception as e:
+            logger.error("Error in URL cache invalidation listener: %s", e)
+            # Entries may have been missed while disconnected
+            _local_urls.clear()
+
+        await asyncio.sleep(retry_interval)
@@ -0,0 +1,108 @@
+import asyncio
+import logging
+import os
+
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app import crud
+from app.database import async_session
+from app.services.cache import get_client
+
+logger = logging.getLogger(__name__)
+
+# How often buffered click counts are written back to urls.clicks
+CLICK_COUNT_FLUSH_INTERVAL_SECONDS = float(
+    os.getenv("CLICK_COUNT_FLUSH_INTERVAL_SECONDS", "30")
+)
+
+_KEY_PREFIX = "c:"
+
+
+async def bump(
+    url_id: int, session_factory: async_sessionmaker[AsyncSession] = async_session
+) -> None:
+    """
+    Count a click for a URL.
+    Buffered in Redis when configured, otherwise written straight to the database
+    in a session of its own.
+    """
+    client = get_client()
+    if client is not None:
+        try:
+            await client.incr(f"{_KEY_PREFIX}{url_id}")
+            return
+        except Exception as e:
+            logger.warning("Error buffering click count: %s", e)
+
+    async with session_factory() as db:
+        await crud.add_click_counts(db, {url_id: 1})
+
+
+async def count_click(
+    url_id: int, session_factory: async_sessionmaker[AsyncSession] = async_session
+) -> None:
+    """
+    Count a click from a background task, logging instead of raising.
+    Runs after the response, once the request's session has been closed, so it
+    opens its own.
+    """
+    try:
+        await bump(url_id, session_factory)
+    except Exception as e:
+        logger.error("Error counting click for URL %s: %s", url_id, e)
+
+
+async def pending_click_count(url_id: int) -> int:
+    """Get the clicks buffered in Redis for a URL but not yet flushed."""
+    client = get_client()
+    if client is None:
+        return 0
+
+    try:
+        pending = await client.get(f"{_KEY_PREFIX}{url_id}")
+    except Exception as e:
+        logger.warning("Error reading buffered click count: %s", e)
+        return 0
+    return int(pending or 0)
+
+
+async def flush_click_counts(
+    session_factory: async_sessionmaker[AsyncSession] = async_session,
+) -> int:
+    """
+    Move buffered click counts from Redis into urls.clicks.
+    Returns the number of URLs updated.
+    """
+    client = get_client()
+    if client is None:
+        return 0
+
+    deltas: dict[int, int] = {}
+    async for key in client.scan_iter(match=f"{_KEY_PREFIX}*"):
+        delta = await client.getdel(key)
+        if delta:
+            deltas[int(key.removeprefix(_KEY_PREFIX))] = int(delta)
+
+    if not deltas:
+        return 0
+
+    try:
+        async with session_factory() as db:
+            return await crud.add_click_counts(db, deltas)
+    except Exception:
+        # Put the counts back so the next flush retries them
+        for url_id, delta in deltas.items():
+            await client.incrby(f"{_KEY_PREFIX}{url_id}", delta)
+        raise
+
+
+async def run_click_count_flush(
+    interval: float = CLICK_COUNT_FLUSH_INTERVAL_SECONDS,
+) -> None:
+    """Periodically flush buffered click counts to the database."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await flush_click_counts()
+        except Exception as e:
+            logger.error("Error flushing click counts: %s", e)
@@ -0,0 +1,109 @@
+import asyncio
+import logging
+import os
+from typing import Any, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app import crud
+from app.database import async_session
+
+logger = logging.getLogger(__name__)
+
+# Clicks waiting to be written; bounded so a stalled writer can't exhaust memory
+CLICK_QUEUE_MAXSIZE = int(os.getenv("CLICK_QUEUE_MAXSIZE", "10000"))
+# Maximum clicks per INSERT and how long to wait for a batch to fill up
+CLICK_BATCH_SIZE = int(os.getenv("CLICK_BATCH_SIZE", "500"))
+CLICK_FLUSH_INTERVAL_SECONDS = float(os.getenv("CLICK_FLUSH_INTERVAL_SECONDS", "0.1"))
+
+# Created by the running writer so it is bound to the application's event loop
+_click_queue: Optional[asyncio.Queue[dict[str, Any]]] = None
+
+
+def enqueue_click(click: dict[str, Any]) -> bool:
+    """
+    Queue a click for the background writer without waiting on the database.
+    Returns False if the writer is not running or the queue is full.
+    """
+    if _click_queue is None:
+        logger.warning(
+            "Click writer not running, dropping click for URL %s", click["url_id"]
+        )
+        return False
+
+    try:
+        _click_queue.put_nowait(click)
+        return True
+    except asyncio.QueueFull:
+        logger.warning("Click queue full, dropping click for URL %s", click["url_id"])
+        return False
+
+
+def _drain(
+    queue: asyncio.Queue[dict[str, Any]], batch: list[dict[str, Any]], batch_size: int
+) -> None:
+    """Move already-queued clicks into the batch without waiting."""
+    while len(batch) < batch_size:
+        try:
+            batch.append(queue.get_nowait())
+        except asyncio.QueueEmpty:
+            break
+
+
+async def _write_batch(
+    batch: list[dict[str, Any]], session_factory: async_sessionmaker[AsyncSession]
+) -> None:
+    """Write a batch of clicks in one INSERT, logging instead of raising."""
+    try:
+        async with session_factory() as db:
+            await crud.bulk_create_click_analytics(db, batch)
+    except Exception as e:
+        logger.error("Error writing %s clicks: %s", len(batch), e)
+
+
+async def run_click_writer(
+    session_factory: async_sessionmaker[AsyncSession] = async_session,
+    batch_size: int = CLICK_BATCH_SIZE,
+    flush_interval: float = CLICK_FLUSH_INTERVAL_SECONDS,
+) -> None:
+    """
+    Consume queued clicks and write them in batches.
+    A batch is written once it is full or flush_interval has passed since its
+    first click, whichever comes first.
+    """
+    global _click_queue
+    queue = _click_queue = asyncio.Queue(maxsize=CLICK_QUEUE_MAXSIZE)
+    loop = asyncio.get_running_loop()
+
+    while True:
+        batch = [await queue.get()]
+        deadline = loop.time() + flush_interval
+        try:
+            while len(batch) < batch_size:
+                _drain(queue, batch, batch_size)
+                timeout = deadline - loop.time()
+                if len(batch) >= batch_size or timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), timeout))
+                except TimeoutError:
+                    break
+        finally:
+            # Also runs on cancellation so a half-filled batch isn't lost
+            await _write_batch(batch, session_factory)
+
+
+async def flush_clicks(
+    session_factory: async_sessionmaker[AsyncSession] = async_session,
+    batch_size: int = CLICK_BATCH_SIZE,
+) -> None:
+    """Stop accepting clicks and write everything still queued, e.g. on shutdown."""
+    global _click_queue
+    queue, _click_queue = _click_queue, None
+    if queue is None:
+        return
+
+    while not queue.empty():
+        batch: list[dict[str, Any]] = []
+        _drain(queue, batch, batch_size)
+        await _write_batch(batch, session_factory)
@@ -1,89 +1,480 @@
-from typing import AsyncGenerator
+import asyncio
+import hashlib
+import logging
+import os
+import sqlite3
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncGenerator, AsyncIterator, Callable, Iterator, Optional
 
 import pytest
 import pytest_asyncio
-from fastapi.testclient import TestClient
+from fastapi import FastAPI
+from httpx import ASGITransport, AsyncClient
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
-from sqlalchemy.pool import StaticPool
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import NullPool, StaticPool
 
-from app.database import get_db
-from app.models import Base
+from app import crud, schemas
+from app.core import security
+from app.core.auth import create_access_token
+from app.database import get_db, get_session_factory
+from app.models import URL, Base, URLClick, User
+from app.services import cache, click_queue
 from main import app
+from tests._helpers import FakeRedis
 
-# Test database URL (using in-memory SQLite for tests)
-TEST_DATABASE_URL = "sqlite+aiosqlite:///:memory:"
+try:
+    import uvloop
+except ImportError:  # pragma: no cover - uvloop is not available on Windows
+    uvloop = None
+
+# Test database URL: a named in-memory SQLite database, one per xdist worker
+TEST_DATABASE_NAME = f"test_{os.environ.get('PYTEST_XDIST_WORKER', 'main')}"
+TEST_DATABASE_URI = f"file:{TEST_DATABASE_NAME}?mode=memory&cache=shared"
+TEST_DATABASE_URL = f"sqlite+aiosqlite:///{TEST_DATABASE_URI}&uri=true"
 
 # Create test engine
 test_engine = create_async_engine(
     TEST_DATABASE_URL,
     connect_args={"check_same_thread": False},
     poolclass=StaticPool,
+    # The single in-memory connection can't go stale
+    pool_pre_ping=False,
+    echo=False,
+    echo_pool=False,
+)
+
+
+# The test database is throwaway, so skip durability work on every write
+TEST_SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=MEMORY",
+    "PRAGMA synchronous=OFF",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA locking_mode=EXCLUSIVE",
+    "PRAGMA cache_size=-64000",
 )
 
+
+def _apply_test_pragmas(dbapi_connection) -> None:
+    cursor = dbapi_connection.cursor()
+    for pragma in TEST_SQLITE_PRAGMAS:
+        cursor.execute(pragma)
+    cursor.close()
+
+
+@event.listens_for(test_engine.sync_engine, "connect")
+def _configure_sqlite(dbapi_connection, connection_record) -> None:
+    # Let SQLAlchemy emit BEGIN itself so SAVEPOINTs work with the sqlite driver
+    dbapi_connection.isolation_level = None
+    _apply_test_pragmas(dbapi_connection)
+
+
+@event.listens_for(test_engine.sync_engine, "begin")
+def _emit_begin(conn) -> None:
+    conn.exec_driver_sql("BEGIN")
+
+
+# Database the seeded analytics dataset is restored into for each test
+SEED_DATABASE_URI = (
+    f"file:seed_{os.environ.get('PYTEST_XDIST_WORKER', 'main')}"
+    "?mode=memory&cache=shared"
+)
+seed_engine = create_async_engine(
+    f"sqlite+aiosqlite:///{SEED_DATABASE_URI}&uri=true",
+    connect_args={"check_same_thread": False},
+    poolclass=NullPool,
+)
+
+
+@event.listens_for(seed_engine.sync_engine, "connect")
+def _configure_seed_sqlite(dbapi_connection, connection_record) -> None:
+    # NullPool reconnects for every session, so each connection needs them
+    _apply_test_pragmas(dbapi_connection)
+
+
 # Create test session factory
 TestSessionLocal = async_sessionmaker(
-    bind=test_engine,
     class_=AsyncSession,
     expire_on_commit=False,
+    autoflush=False,
 )
 
 
-@pytest_asyncio.fixture(scope="function")
-async def db_session() -> AsyncGenerator[AsyncSession, None]:
-    """Create a fresh database session for each test."""
+class _NoDatabase:
+    """
+    Stand-in session for tests without db_session. Dependencies that merely
+    receive it are fine, which lets auth reject a request with 401 first;
+    any actual use fails loudly instead of touching the database.
+    """
+
+    def __getattr__(self, name: str) -> Any:
+        raise RuntimeError(
+            f"Database used without the db_session fixture (AsyncSession.{name})"
+        )
+
+
+# Session of the running test, served to the app in place of get_db
+_current_session: Optional[AsyncSession] = None
+
+
+def _joined_session_factory(session: AsyncSession) -> async_sessionmaker[AsyncSession]:
+    """
+    Build a factory whose sessions join the test session's outer transaction,
+    so what they commit is rolled back with it.
+    """
+    return async_sessionmaker(
+        bind=session.bind,
+        class_=AsyncSession,
+        expire_on_commit=False,
+        join_transaction_mode="create_savepoint",
+    )
+
+
+# bcrypt's minimum work factor, for tests that need real hashes
+TEST_BCRYPT_ROUNDS = 4
+
+# Prefix marking hashes made by the fast test stub below
+_FAST_HASH_PREFIX = "test-sha256$"
+
+
+def _fast_hash_password(password: str) -> str:
+    return _FAST_HASH_PREFIX + hashlib.sha256(password.encode("utf-8")).hexdigest()
+
+
+def _fast_verify_password(password: str, hashed_password: str) -> bool:
+    if hashed_password.startswith(_FAST_HASH_PREFIX):
+        return security.secure_equals(_fast_hash_password(password), hashed_password)
+    return security.verify_password(password, hashed_password)
+
+
+def _fast_needs_rehash(hashed_password: str) -> bool:
+    if hashed_password.startswith(_FAST_HASH_PREFIX):
+        return False
+    return security.needs_rehash(hashed_password)
+
+
+@pytest.fixture(autouse=True)
+def _fast_password_hashing(
+    request: pytest.FixtureRequest, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """
+    Replace bcrypt with a fast sha256 stub, which is irrelevant to most tests.
+    Tests marked real_crypto keep real bcrypt, at its minimum cost factor.
+    """
+    if request.node.get_closest_marker("real_crypto"):
+        monkeypatch.setattr(security, "BCRYPT_ROUNDS", TEST_BCRYPT_ROUNDS)
+        return
+
+    monkeypatch.setattr("app.models.user.hash_password", _fast_hash_password)
+    monkeypatch.setattr("app.models.user.verify_password", _fast_verify_password)
+    monkeypatch.setattr("app.crud.user.needs_rehash", _fast_needs_rehash)
+
+
+# Loggers that emit a record per query or request at INFO level
+QUIET_LOGGERS = ("sqlalchemy.engine", "httpx", "app", "main")
+
+
+@pytest.fixture(scope="session", autouse=True)
+def _quiet_logging() -> Iterator[None]:
+    """Keep per-query and per-request log formatting out of the test run."""
+    levels = {name: logging.getLogger(name).level for name in QUIET_LOGGERS}
+    for name in QUIET_LOGGERS:
+        logging.getLogger(name).setLevel(logging.WARNING)
+    access_logger = logging.getLogger("uvicorn.access")
+    access_logger.disabled = True
+
+    yield
+
+    access_logger.disabled = False
+    for name, level in levels.items():
+        logging.getLogger(name).setLevel(level)
+
+
+@pytest.fixture(scope="session")
+def event_loop_policy() -> asyncio.AbstractEventLoopPolicy:
+    """Run the async tests on uvloop where it is installed."""
+    if uvloop is not None:
+        return uvloop.EventLoopPolicy()
+    return asyncio.DefaultEventLoopPolicy()
+
+
+@pytest_asyncio.fixture(scope="session")
+async def db_schema() -> AsyncGenerator[None, None]:
+    """Create the database schema once for the whole test run."""
+    # SQLite discards a shared in-memory database once its last connection
+    # closes; hold one open so the schema survives engine reconnects
+    keepalive = sqlite3.connect(TEST_DATABASE_URI, uri=True)
+
     async with test_engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
 
-    async with TestSessionLocal() as session:
-        yield session
+    yield
 
-    async with test_engine.begin() as conn:
-        await conn.run_sync(Base.metadata.drop_all)
+    # Closing the last connections discards the in-memory database, schema and all
+    await test_engine.dispose()
+    keepalive.close()
+
+
+@pytest_asyncio.fixture(scope="function")
+async def db_session(db_schema: None) -> AsyncGenerator[AsyncSession, None]:
+    """
+    Create a database session for each test.
+    The test runs inside an outer transaction that is rolled back afterwards;
+    commits made by the code under test only release SAVEPOINTs.
+    """
+    global _current_session
+
+    async with test_engine.connect() as conn:
+        trans = await conn.begin()
+        async with TestSessionLocal(
+            bind=conn, join_transaction_mode="create_savepoint"
+        ) as session:
+            _current_session = session
+            yield session
+            _current_session = None
+        await trans.rollback()
+
+    # Rolled-back rows must not linger in the in-process redirect cache
+    cache._local_urls.clear()
+
+
+@pytest.fixture(scope="function")
+def db_session_factory(db_session: AsyncSession) -> async_sessionmaker[AsyncSession]:
+    """
+    Session factory for code that opens its own sessions, such as the background
+    click writers. Sessions join the test's outer transaction, so what they
+    commit is rolled back with it.
+    """
+    return _joined_session_factory(db_session)
+
+
+@pytest.fixture(scope="function")
+def queued_clicks(monkeypatch: pytest.MonkeyPatch) -> asyncio.Queue:
+    """
+    Stand in for a running click writer by installing an empty click queue.
+    Queued clicks stay there until the test flushes them.
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=click_queue.CLICK_QUEUE_MAXSIZE)
+    monkeypatch.setattr(click_queue, "_click_queue", queue)
+    return queue
 
 
 @pytest.fixture(scope="function")
-def client(db_session: AsyncSession):
-    """Create a test client with database dependency override."""
+def fake_redis(monkeypatch: pytest.MonkeyPatch) -> FakeRedis:
+    """Serve an in-memory fake as the shared Redis client."""
+    client = FakeRedis()
+    monkeypatch.setattr(cache, "_client", client)
+    return client
+
+
+@pytest.fixture(scope="session")
+def analytics_template() -> Iterator[dict]:
+    """
+    Build the analytics dataset shared by several tests once, in a private
+    in-memory database: one URL with five clicks from distinct visitors.
+    """
+    template = sqlite3.connect(":memory:", check_same_thread=False)
+    engine = create_engine("sqlite://", creator=lambda: template, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+
+    with Session(engine) as session:
+        url = URL(original_url="https://www.example.com", short_code="seed0001")
+        session.add(url)
+        session.flush()
+        session.add_all(
+            [
+                URLClick(
+                    url_id=url.id,
+                    ip_address=f"192.168.1.{i}",
+                    user_agent=f"Mozilla/5.0 (Test Browser {i})",
+                    referrer="https://www.google.com",
+                )
+                for i in range(5)
+            ]
+        )
+        session.commit()
+        url_id = url.id
+
+    yield {"connection": template, "url_id": url_id}
+
+    engine.dispose()
+
+
+@pytest_asyncio.fixture
+async def seeded_db_session(
+    analytics_template: dict,
+) -> AsyncGenerator[AsyncSession, None]:
+    """
+    Create a session on a fresh copy of the analytics dataset.
+    The copy is restored page by page with SQLite's backup API instead of
+    re-inserting the rows, and is discarded after the test.
+    """
+    # Holding this connection keeps the in-memory copy alive during the test
+    target = sqlite3.connect(SEED_DATABASE_URI, uri=True)
+    analytics_template["connection"].backup(target)
+
+    async with TestSessionLocal(bind=seed_engine) as session:
+        yield session
+
+    target.close()
+
+
+@contextmanager
+def override_dependency(
+    dependency: Callable[..., Any], override: Callable[..., Any]
+) -> Iterator[None]:
+    """
+    Override one app dependency, restoring whatever was there before on exit.
+    Unlike clearing app.dependency_overrides, this leaves other overrides alone.
+    """
+    missing = object()
+    previous = app.dependency_overrides.get(dependency, missing)
+    app.dependency_overrides[dependency] = override
+    try:
+        yield
+    finally:
+        if previous is missing:
+            app.dependency_overrides.pop(dependency, None)
+        else:
+            app.dependency_overrides[dependency] = previous
+
+
+@asynccontextmanager
+async def _no_lifespan(app: FastAPI) -> AsyncIterator[None]:
+    yield
+
+
+@pytest_asyncio.fixture(scope="session")
+async def app_client() -> AsyncGenerator[AsyncClient, None]:
+    """
+    Create one HTTP client for the whole run, serving the current test's session.
+    The production lifespan is swapped for a no-op: the schema is created on the
+    test engine by db_schema, and the background workers are not needed.
+    Tests that are rejected before touching the database (validation and
+    authentication failures) use it directly, without a db_session; they are
+    served a _NoDatabase stand-in instead of a session.
+    Background tasks get a session factory joined to the same test transaction.
+    """
 
     def override_get_db() -> AsyncSession:
-        return db_session
+        return _current_session if _current_session is not None else _NoDatabase()
+
+    def override_get_session_factory() -> Callable[[], AsyncSession]:
+        if _current_session is None:
+            return _NoDatabase
+        return _joined_session_factory(_current_session)
+
+    lifespan_context = app.router.lifespan_context
+    app.router.lifespan_context = _no_lifespan
+
+    with (
+        override_dependency(get_db, override_get_db),
+        override_dependency(get_session_factory, override_get_session_factory),
+    ):
+        async with AsyncClient(
+            transport=ASGITransport(app=app), base_url="http://test"
+        ) as ac:
+            yield ac
+
+    app.router.lifespan_context = lifespan_context
+
+
+@pytest_asyncio.fixture(scope="function")
+async def failing_db_client() -> AsyncGenerator[AsyncClient, None]:
+    """
+    Create an HTTP client whose database dependency raises an unexpected error.
+    App exceptions are returned as responses instead of re-raised, so tests see
+    what the catch-all exception handler sends.
+    """
+
+    def failing_get_db() -> AsyncSession:
+        raise RuntimeError("connection to db-internal:5432 refused")
+
+    with override_dependency(get_db, failing_get_db):
+        async with AsyncClient(
+            transport=ASGITransport(app=app, raise_app_exceptions=False),
+            base_url="http://test",
+        ) as ac:
+            yield ac
 
-    app.dependency_overrides[get_db] = override_get_db
 
-    with TestClient(app) as tc:
-        yield tc
+@pytest.fixture(scope="function")
+def client(app_client: AsyncClient, db_session: AsyncSession) -> AsyncClient:
+    """Get the shared HTTP client with the database isolated for this test."""
+    return app_client
+
 
-    app.dependency_overrides.clear()
+TEST_USER_DATA = {
+    "username": "testuser",
+    "email": "test@example.com",
+    "password": "TestPass123!",
+}
 
 
 @pytest.fixture
 def test_user_data() -> dict[str, str]:
     """Test user data for registration."""
+    return dict(TEST_USER_DATA)
+
+
+@pytest.fixture(scope="session")
+def registered_user() -> dict:
+    """
+    Hash the test user's password and issue its token once for the whole run.
+    The hash comes from the fast test stub, so tests marked real_crypto should
+    create their own users.
+    """
     return {
-        "username": "testuser",
-        "email": "test@example.com",
-        "password": "TestPass123!",
+        "user_data": dict(TEST_USER_DATA),
+        "hashed_password": _fast_hash_password(TEST_USER_DATA["password"]),
+        "token": create_access_token(data={"sub": TEST_USER_DATA["username"]}),
     }
 
 
-@pytest.fixture
-def auth_headers(client, test_user_data: dict) -> dict:
-    """Create a test user and return authentication headers."""
-    # Register user
-    client.post("/api/v1/auth/register", json=test_user_data)
-
-    # Login to get token
-    login_data = {
-        "username": test_user_data["username"],
-        "password": test_user_data["password"],
-    }
-    response = client.post("/api/v1/auth/login", data=login_data)
-    token = response.json()["access_token"]
+@pytest_asyncio.fixture
+async def test_user(db_session: AsyncSession, registered_user: dict) -> User:
+    """
+    Create the registered test user without going through /auth/register.
+    The row is rolled back with each test, so it is inserted per test.
+    """
+    user_data = registered_user["user_data"]
+    user = User(
+        username=user_data["username"],
+        email=user_data["email"],
+        hashed_password=registered_user["hashed_password"],
+    )
+    db_session.add(user)
+    await db_session.commit()
+    return user
 
-    return {"Authorization": f"Bearer {token}"}
+
+@pytest.fixture
+def auth_headers(test_user: User, registered_user: dict) -> dict:
+    """Create the test user and return authentication headers."""
+    return {"Authorization": f"Bearer {registered_user['token']}"}
 
 
 @pytest.fixture
 def test_url_data() -> dict[str, str]:
     """Test URL data for creating short URLs."""
     return {"original_url": "https://www.example.com"}
+
+
+@pytest_asyncio.fixture
+async def short_url(db_session: AsyncSession, test_url_data: dict) -> URL:
+    """
+    Create an anonymous short URL directly, for endpoint tests that start from
+    an existing one rather than testing /shorten itself.
+    """
+    return await crud.create_url(db_session, schemas.URLCreate(**test_url_data))
+
+
+@pytest_asyncio.fixture
+async def user_short_url(
+    db_session: AsyncSession, test_user: User, test_url_data: dict
+) -> URL:
+    """Create a short URL owned by the test user directly."""
+    return await crud.create_url(
+        db_session, schemas.URLCreate(**test_url_data), test_user.id
+    )
@@ -1,15 +1,29 @@
+import asyncio
+import atexit
 import logging
-from contextlib import asynccontextmanager
+import queue
+from contextlib import asynccontextmanager, suppress
+from logging.handlers import QueueHandler, QueueListener
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Request, status
+from fastapi.responses import ORJSONResponse
 
 from app.database import engine
 from app.middleware.analytics import AnalyticsMiddleware
 from app.models import Base
 from app.routers import auth, shortener
+from app.services.analytics_rollup import run_daily_rollup
+from app.services.cache import run_invalidation_listener
+from app.services.click_counter import flush_click_counts, run_click_count_flush
+from app.services.click_queue import flush_clicks, run_click_writer
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# Configure logging; records are handed off to a background thread so
+# writing them out never blocks the event loop
+log_queue: queue.SimpleQueue = queue.SimpleQueue()
+logging.basicConfig(level=logging.INFO, handlers=[QueueHandler(log_queue)])
+log_listener = QueueListener(log_queue, logging.StreamHandler())
+log_listener.start()
+atexit.register(log_listener.stop)
 logger = logging.getLogger(__name__)
 
 
@@ -19,9 +33,22 @@ async def lifespan(app: FastAPI):
     logger.info("Starting FastAPI application...")
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+    rollup_task = asyncio.create_task(run_daily_rollup())
+    click_writer_task = asyncio.create_task(run_click_writer())
+    click_count_task = asyncio.create_task(run_click_count_flush())
+    invalidation_task = asyncio.create_task(run_invalidation_listener())
     yield
     # Shutdown logic
     logger.info("Shutting down FastAPI application...")
+    for task in (rollup_task, click_writer_task, click_count_task, invalidation_task):
+        task.cancel()
+        with suppress(asyncio.CancelledError):
+            await task
+    await flush_clicks()
+    try:
+        await flush_click_counts()
+    except Exception as e:
+        logger.error("Error flushing click counts: %s", e)
 
 
 app = FastAPI(
@@ -29,8 +56,20 @@ app = FastAPI(
     description="A FastAPI URL shortener with analytics tracking",
     version="0.1.0",
     lifespan=lifespan,
+    default_response_class=ORJSONResponse,
 )
 
+
+@app.exception_handler(Exception)
+async def unhandled_exception_handler(request: Request, exc: Exception):
+    """Log unexpected errors and hide their details behind a generic 500."""
+    logger.error("Error handling %s %s: %s", request.method, request.url.path, exc)
+    return ORJSONResponse(
+        status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+        content={"detail": "Internal server error"},
+    )
+
+
 # Add middleware
 app.add_middleware(AnalyticsMiddleware)
 
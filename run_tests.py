@@ -6,17 +6,19 @@ Usage:
     python run_tests.py                    # Run all tests
     python run_tests.py --coverage         # Run with coverage report
     python run_tests.py --verbose          # Run with verbose output
+    python run_tests.py --parallel         # Run across all CPU cores
     python run_tests.py tests/test_auth.py # Run specific test file
 """
 
 import argparse
-import subprocess
 import sys
 
+import pytest
+
 
 def run_tests(args) -> None:
     """Run pytest with the specified arguments."""
-    cmd = ["python", "-m", "pytest"]
+    cmd = []
 
     if args.coverage:
         cmd.extend(
@@ -31,6 +33,10 @@ def run_tests(args) -> None:
     if args.verbose:
         cmd.append("-v")
 
+    if args.parallel:
+        # Keep each test module on one worker so module-level state stays local
+        cmd.extend(["-n", "auto", "--dist=loadfile"])
+
     if args.test_files:
         cmd.extend(args.test_files)
     else:
@@ -39,11 +45,12 @@ def run_tests(args) -> None:
     if args.markers:
         cmd.extend(["-m", args.markers])
 
-    print(f"Running command: {' '.join(cmd)}")
-    result = subprocess.run(cmd)
+    print(f"Running command: pytest {' '.join(cmd)}")
+    # Run in this interpreter rather than paying for a second one
+    exit_code = pytest.main(cmd)
 
-    if result.returncode != 0:
-        sys.exit(result.returncode)
+    if exit_code != 0:
+        sys.exit(exit_code)
 
 
 def main() -> None:
@@ -55,6 +62,9 @@ def main() -> None:
     parser.add_argument(
         "--verbose", action="store_true", help="Run with verbose output"
     )
+    parser.add_argument(
+        "--parallel", action="store_true", help="Run tests in parallel (pytest-xdist)"
+    )
     parser.add_argument("test_files", nargs="*", help="Specific test files to run")
     parser.add_argument("-m", "--markers", help="Pytest markers to filter tests")
 
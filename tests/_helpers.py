@@ -0,0 +1,113 @@
+import asyncio
+from fnmatch import fnmatchcase
+from typing import Any, AsyncIterator, Optional
+
+from sqlalchemy import ColumnElement, func, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.crud.url import generate_short_code
+from app.database import Base
+from app.models import URL, URLClick
+
+
+async def bulk_create_urls(
+    db: AsyncSession, original_urls: list[str], user_id: Optional[int] = None
+) -> list[int]:
+    """Insert URLs in one Core statement and return their ids in order."""
+    result = await db.execute(
+        insert(URL).returning(URL.id, sort_by_parameter_order=True),
+        [
+            {
+                "original_url": url,
+                "short_code": generate_short_code(),
+                "clicks": 0,
+                "user_id": user_id,
+            }
+            for url in original_urls
+        ],
+    )
+    url_ids = list(result.scalars())
+    await db.commit()
+    return url_ids
+
+
+async def bulk_create_clicks(db: AsyncSession, rows: list[dict[str, Any]]) -> None:
+    """
+    Insert raw click rows in one Core executemany, bypassing the ORM.
+    User agents are stored as given; device_type and browser are not derived.
+    """
+    await db.execute(insert(URLClick), rows)
+    await db.commit()
+
+
+async def count_rows(
+    db: AsyncSession, model: type[Base], *criteria: ColumnElement[bool]
+) -> int:
+    """Count a model's rows matching the criteria in a single query."""
+    result = await db.execute(select(func.count()).select_from(model).where(*criteria))
+    return result.scalar_one()
+
+
+class FakeRedis:
+    """In-memory stand-in for the redis.asyncio commands the app uses."""
+
+    def __init__(self) -> None:
+        self.data: dict[str, str] = {}
+        self.subscribers: list[FakePubSub] = []
+
+    async def get(self, key: str) -> Optional[str]:
+        return self.data.get(key)
+
+    async def set(self, key: str, value: Any, ex: Optional[int] = None) -> None:
+        self.data[key] = str(value)
+
+    async def delete(self, key: str) -> None:
+        self.data.pop(key, None)
+
+    async def getdel(self, key: str) -> Optional[str]:
+        return self.data.pop(key, None)
+
+    async def incr(self, key: str) -> int:
+        return await self.incrby(key, 1)
+
+    async def incrby(self, key: str, amount: int) -> int:
+        value = int(self.data.get(key, 0)) + amount
+        self.data[key] = str(value)
+        return value
+
+    async def publish(self, channel: str, message: str) -> None:
+        for pubsub in self.subscribers:
+            if channel in pubsub.channels:
+                pubsub.messages.put_nowait({"type": "message", "data": message})
+
+    def pubsub(self) -> "FakePubSub":
+        return FakePubSub(self)
+
+    async def scan_iter(self, match: str = "*") -> AsyncIterator[str]:
+        for key in list(self.data):
+            if fnmatchcase(key, match):
+                yield key
+
+
+class FakePubSub:
+    """Subscription on a FakeRedis; messages are queued until listened for."""
+
+    def __init__(self, client: FakeRedis) -> None:
+        self.client = client
+        self.channels: set[str] = set()
+        self.messages: asyncio.Queue[dict[str, Any]] = asyncio.Queue()
+
+    async def __aenter__(self) -> "FakePubSub":
+        self.client.subscribers.append(self)
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        self.client.subscribers.remove(self)
+
+    async def subscribe(self, channel: str) -> None:
+        self.channels.add(channel)
+        self.messages.put_nowait({"type": "subscribe", "data": 1})
+
+    async def listen(self) -> AsyncIterator[dict[str, Any]]:
+        while True:
+            yield await self.messages.get()
@@ -1,19 +1,27 @@
-from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import UTC, datetime, time, timedelta
+
 import pytest
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
 
 from app import crud, schemas
+from app.models import URLClick, URLClickDailyStats
+from tests._helpers import bulk_create_clicks, bulk_create_urls
+
+USER_DATA = schemas.UserCreate(
+    username="testuser", email="test@example.com", password="TestPass123!"
+)
+URL_DATA = schemas.URLCreate(original_url="https://www.example.com")
 
 
 class TestAnalyticsCRUD:
     """Test analytics CRUD operations."""
 
-    @pytest.mark.asyncio
-
     async def test_create_click_analytics(self, db_session: AsyncSession):
         """Test creating click analytics."""
         # Create URL first
-        url_data = schemas.URLCreate(original_url="https://www.example.com")
-        url = await crud.create_url(db_session, url_data)
+        url = await crud.create_url(db_session, URL_DATA)
 
         # Create analytics
         analytics = await crud.create_click_analytics(
@@ -30,54 +38,69 @@ class TestAnalyticsCRUD:
         assert analytics.user_agent == "Mozilla/5.0 (Test Browser)"
         assert analytics.referrer == "https://www.google.com"
 
-    @pytest.mark.asyncio
-
-    async def test_get_url_analytics_summary(self, db_session: AsyncSession):
-        """Test getting URL analytics summary."""
+    async def test_bulk_create_click_analytics(self, db_session: AsyncSession):
+        """Test creating many click analytics records at once."""
         # Create URL first
-        url_data = schemas.URLCreate(original_url="https://www.example.com")
-        url = await crud.create_url(db_session, url_data)
+        url = await crud.create_url(db_session, URL_DATA)
 
-        # Create some analytics data
-        for i in range(5):
-            await crud.create_click_analytics(
-                db=db_session,
-                url_id=url.id,
-                ip_address=f"192.168.1.{i}",
-                user_agent=f"Mozilla/5.0 (Test Browser {i})",
-                referrer="https://www.google.com",
-            )
+        mobile_ua = "Mozilla/5.0 (iPhone; CPU iPhone OS 14_0 like Mac OS X) AppleWebKit/605.1.15"
+        created = await crud.bulk_create_click_analytics(
+            db_session,
+            [
+                {
+                    "url_id": url.id,
+                    "ip_address": "192.168.1.1",
+                    "user_agent": mobile_ua,
+                },
+                {"url_id": url.id, "ip_address": "192.168.1.2"},
+            ],
+        )
+
+        assert created == 2
+        clicks = await crud.get_url_clicks(db_session, url.id)
+        assert len(clicks) == 2
+        assert {click.device_type for click in clicks} == {"mobile", None}
+
+    async def test_get_url_analytics_summary(
+        self, seeded_db_session: AsyncSession, analytics_template: dict
+    ):
+        """Test getting URL analytics summary."""
+        # Seeded with one URL and five clicks
+        url_id = analytics_template["url_id"]
 
         # Get analytics summary
-        summary = await crud.get_url_analytics_summary(db_session, url.id, days=30)
+        summary = await crud.get_url_analytics_summary(
+            seeded_db_session, url_id, days=30
+        )
 
         assert summary is not None
         assert summary.total_clicks == 5
         assert summary.unique_visitors == 5  # All different IPs
+        assert summary.top_referrers == {"https://www.google.com": 5}
         assert "device_breakdown" in summary.__dict__
         assert "browser_breakdown" in summary.__dict__
 
-    @pytest.mark.asyncio
-
     async def test_get_global_analytics_summary(self, db_session: AsyncSession):
         """Test getting global analytics summary."""
         # Create multiple URLs
-        urls = []
-        for i in range(3):
-            url_data = schemas.URLCreate(original_url=f"https://www.example{i}.com")
-            url = await crud.create_url(db_session, url_data)
-            urls.append(url)
+        url_ids = await bulk_create_urls(
+            db_session, [f"https://www.example{i}.com" for i in range(3)]
+        )
 
         # Create analytics data for different URLs
-        for i, url in enumerate(urls):
-            for j in range(2):
-                await crud.create_click_analytics(
-                    db=db_session,
-                    url_id=url.id,
-                    ip_address=f"192.168.1.{i}{j}",
-                    user_agent=f"Mozilla/5.0 (Test Browser {i}{j})",
-                    referrer="https://www.google.com",
-                )
+        await bulk_create_clicks(
+            db_session,
+            [
+                {
+                    "url_id": url_id,
+                    "ip_address": f"192.168.1.{i}{j}",
+                    "user_agent": f"Mozilla/5.0 (Test Browser {i}{j})",
+                    "referrer": "https://www.google.com",
+                }
+                for i, url_id in enumerate(url_ids)
+                for j in range(2)
+            ],
+        )
 
         # Get global analytics summary
         summary = await crud.get_global_analytics_summary(db_session, days=30)
@@ -88,13 +111,26 @@ class TestAnalyticsCRUD:
         assert "device_breakdown" in summary.__dict__
         assert "browser_breakdown" in summary.__dict__
 
-    @pytest.mark.asyncio
+    async def test_get_user_analytics_summary(self, db_session: AsyncSession):
+        """Test that user analytics only count clicks on the user's URLs."""
+        user = await crud.create_user(db_session, USER_DATA)
+        own_url = await crud.create_url(db_session, URL_DATA, user.id)
+        other_url = await crud.create_url(db_session, URL_DATA)
+
+        for i, url in enumerate([own_url, own_url, other_url]):
+            await crud.create_click_analytics(
+                db=db_session, url_id=url.id, ip_address=f"192.168.1.{i}"
+            )
+
+        summary = await crud.get_user_analytics_summary(db_session, user.id, days=30)
+
+        assert summary.total_clicks == 2
+        assert summary.unique_visitors == 2
 
     async def test_analytics_device_detection(self, db_session: AsyncSession):
         """Test device detection in analytics."""
         # Create URL first
-        url_data = schemas.URLCreate(original_url="https://www.example.com")
-        url = await crud.create_url(db_session, url_data)
+        url = await crud.create_url(db_session, URL_DATA)
 
         # Create analytics with different user agents
         mobile_ua = "Mozilla/5.0 (iPhone; CPU iPhone OS 14_0 like Mac OS X) AppleWebKit/605.1.15"
@@ -127,13 +163,10 @@ class TestAnalyticsCRUD:
         device_breakdown = getattr(summary, "device_breakdown", {})
         assert len(device_breakdown) > 0
 
-    @pytest.mark.asyncio
-
     async def test_analytics_browser_detection(self, db_session: AsyncSession):
         """Test browser detection in analytics."""
         # Create URL first
-        url_data = schemas.URLCreate(original_url="https://www.example.com")
-        url = await crud.create_url(db_session, url_data)
+        url = await crud.create_url(db_session, URL_DATA)
 
         # Create analytics with different browsers
         chrome_ua = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
@@ -166,29 +199,19 @@ class TestAnalyticsCRUD:
         browser_breakdown = getattr(summary, "browser_breakdown", {})
         assert len(browser_breakdown) > 0
 
-    @pytest.mark.asyncio
-
-    async def test_analytics_time_filtering(self, db_session: AsyncSession):
+    async def test_analytics_time_filtering(
+        self, seeded_db_session: AsyncSession, analytics_template: dict
+    ):
         """Test analytics time filtering."""
-        # Create URL first
-        url_data = schemas.URLCreate(original_url="https://www.example.com")
-        url = await crud.create_url(db_session, url_data)
-
-        # Create analytics data
-        for i in range(5):
-            await crud.create_click_analytics(
-                db=db_session,
-                url_id=url.id,
-                ip_address=f"192.168.1.{i}",
-                user_agent=f"Mozilla/5.0 (Test Browser {i})",
-            )
+        # Seeded with one URL and five clicks
+        url_id = analytics_template["url_id"]
 
         # Get analytics for different time periods
         summary_7_days = await crud.get_url_analytics_summary(
-            db_session, url.id, days=7
+            seeded_db_session, url_id, days=7
         )
         summary_30_days = await crud.get_url_analytics_summary(
-            db_session, url.id, days=30
+            seeded_db_session, url_id, days=30
         )
 
         # Both should include all clicks since they're created recently
@@ -197,13 +220,10 @@ class TestAnalyticsCRUD:
         assert summary_7_days.unique_visitors == 5
         assert summary_30_days.unique_visitors == 5
 
-    @pytest.mark.asyncio
-
     async def test_analytics_with_no_data(self, db_session: AsyncSession):
         """Test analytics when no data exists."""
         # Create URL first
-        url_data = schemas.URLCreate(original_url="https://www.example.com")
-        url = await crud.create_url(db_session, url_data)
+        url = await crud.create_url(db_session, URL_DATA)
 
         # Get analytics without any clicks
         summary = await crud.get_url_analytics_summary(db_session, url.id, days=30)
@@ -213,3 +233,128 @@ class TestAnalyticsCRUD:
         assert summary.unique_visitors == 0
         assert "device_breakdown" in summary.__dict__
         assert "browser_breakdown" in summary.__dict__
+
+    async def test_cleanup_old_clicks(self, db_session: AsyncSession):
+        """Test deleting old clicks across several batches."""
+        url = await crud.create_url(db_session, URL_DATA)
+
+        old = datetime.now(UTC) - timedelta(days=100)
+        db_session.add_all([URLClick(url_id=url.id, clicked_at=old) for _ in range(5)])
+        await db_session.commit()
+        await crud.create_click_analytics(db=db_session, url_id=url.id)
+
+        deleted = await crud.cleanup_old_clicks(
+            db_session, days_to_keep=90, batch_size=2
+        )
+
+        assert deleted == 5
+        remaining = await crud.get_url_clicks(db_session, url.id)
+        assert len(remaining) == 1
+
+    async def test_refresh_daily_click_stats(self, db_session: AsyncSession):
+        """Test rolling closed days into the daily stats table."""
+        # Create URL first
+        url = await crud.create_url(db_session, URL_DATA)
+
+        # Two clicks on a closed day and one today
+        two_days_ago = datetime.now(UTC) - timedelta(days=2)
+        chrome_ua = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+        db_session.add_all(
+            [
+                URLClick(
+                    url_id=url.id,
+                    ip_address=f"192.168.1.{i}",
+                    clicked_at=two_days_ago,
+                    device_type="desktop",
+                    browser="Chrome",
+                )
+                for i in range(2)
+            ]
+        )
+        await db_session.commit()
+        await crud.create_click_analytics(
+            db=db_session, url_id=url.id, ip_address="192.168.1.9", user_agent=chrome_ua
+        )
+
+        rows = await crud.refresh_daily_click_stats(db_session)
+        assert rows == 1
+
+        result = await db_session.execute(select(URLClickDailyStats))
+        stats = result.scalars().all()
+        assert len(stats) == 1
+        assert stats[0].day == two_days_ago.date()
+        assert stats[0].clicks == 2
+
+        # Refreshing again is a no-op until another day closes
+        assert await crud.refresh_daily_click_stats(db_session) == 0
+
+        # Summary combines the rollup with today's raw clicks
+        summary = await crud.get_url_analytics_summary(db_session, url.id, days=30)
+        assert summary.total_clicks == 3
+        assert summary.refreshed_at is not None
+        assert summary.clicks_in_range == 3
+        assert summary.unique_visitors == 3
+        assert summary.device_breakdown == {"desktop": 3}
+        assert summary.browser_breakdown == {"Chrome": 3}
+        assert summary.daily_clicks[str(two_days_ago.date())] == 2
+
+    async def test_refresh_daily_click_stats_overlapping(
+        self, db_session: AsyncSession
+    ):
+        """Test re-refreshing rolled-up days keeps one row per rollup key."""
+        url = await crud.create_url(db_session, URL_DATA)
+        two_days_ago = datetime.now(UTC) - timedelta(days=2)
+        db_session.add_all(
+            [
+                URLClick(
+                    url_id=url.id,
+                    clicked_at=two_days_ago,
+                    device_type="desktop",
+                    browser="Chrome",
+                )
+                for _ in range(2)
+            ]
+        )
+        await db_session.commit()
+
+        since = two_days_ago.date()
+        assert await crud.refresh_daily_click_stats(db_session) == 1
+        assert await crud.refresh_daily_click_stats(db_session, since=since) == 1
+
+        result = await db_session.execute(select(URLClickDailyStats))
+        stats = result.scalars().all()
+        assert [row.clicks for row in stats] == [2]
+
+        # The rollup key is unique, so a second row for it is rejected outright
+        db_session.add(
+            URLClickDailyStats(
+                url_id=url.id,
+                day=since,
+                device_type="desktop",
+                browser="Chrome",
+                clicks=1,
+            )
+        )
+        with pytest.raises(IntegrityError):
+            await db_session.commit()
+
+    async def test_summary_range_matches_rollup_day_boundary(
+        self, db_session: AsyncSession
+    ):
+        """Test the first day of the range counts the same before and after rollup."""
+        url = await crud.create_url(db_session, URL_DATA)
+        first_day = (datetime.now(UTC) - timedelta(days=2)).date()
+        db_session.add(
+            URLClick(
+                url_id=url.id,
+                clicked_at=datetime.combine(first_day, time.min, tzinfo=UTC),
+            )
+        )
+        await db_session.commit()
+
+        before = await crud.get_url_analytics_summary(db_session, url.id, days=2)
+        await crud.refresh_daily_click_stats(db_session)
+        after = await crud.get_url_analytics_summary(db_session, url.id, days=2)
+
+        assert before.clicks_in_range == after.clicks_in_range == 1
+        assert before.daily_clicks == after.daily_clicks == {str(first_day): 1}
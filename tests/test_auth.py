@@ -1,11 +1,11 @@
-import pytest
 from httpx import AsyncClient
 
+from app.models import User
 
-class TestAuthEndpoints:
-    """Test authentication endpoints."""
 
-    @pytest.mark.asyncio
+class TestAuthRegistration:
+    """Test user registration endpoints."""
+
     async def test_register_user_success(
         self, client: AsyncClient, test_user_data: dict
     ):
@@ -19,7 +19,6 @@ class TestAuthEndpoints:
         assert "id" in data
         assert "password" not in data  # Password should not be in response
 
-    @pytest.mark.asyncio
     async def test_register_user_duplicate_username(
         self, client: AsyncClient, test_user_data: dict
     ):
@@ -36,7 +35,6 @@ class TestAuthEndpoints:
         assert response.status_code == 400
         assert "already registered" in response.json()["detail"].lower()
 
-    @pytest.mark.asyncio
     async def test_register_user_duplicate_email(
         self, client: AsyncClient, test_user_data: dict
     ):
@@ -53,36 +51,39 @@ class TestAuthEndpoints:
         assert response.status_code == 400
         assert "already registered" in response.json()["detail"].lower()
 
-    @pytest.mark.asyncio
     async def test_register_user_invalid_email(
-        self, client: AsyncClient, test_user_data: dict
+        self, app_client: AsyncClient, test_user_data: dict
     ):
         """Test registration with invalid email."""
         invalid_user = test_user_data.copy()
         invalid_user["email"] = "invalid-email"
 
-        response = await client.post("/api/v1/auth/register", json=invalid_user)
+        response = await app_client.post("/api/v1/auth/register", json=invalid_user)
 
         assert response.status_code == 422  # Validation error
 
-    @pytest.mark.asyncio
     async def test_register_user_weak_password(
-        self, client: AsyncClient, test_user_data: dict
+        self, app_client: AsyncClient, test_user_data: dict
     ):
         """Test registration with weak password."""
         weak_user = test_user_data.copy()
         weak_user["password"] = "weak"
 
-        response = await client.post("/api/v1/auth/register", json=weak_user)
+        response = await app_client.post("/api/v1/auth/register", json=weak_user)
 
         assert response.status_code == 422  # Validation error
 
-    @pytest.mark.asyncio
-    async def test_login_success(self, client: AsyncClient, test_user_data: dict):
-        """Test successful user login."""
-        # Register user first
-        await client.post("/api/v1/auth/register", json=test_user_data)
 
+class TestAuthLoginAndMe:
+    """
+    Test login and profile endpoints.
+    The user is inserted directly by the test_user fixture instead of registering.
+    """
+
+    async def test_login_success(
+        self, client: AsyncClient, test_user: User, test_user_data: dict
+    ):
+        """Test successful user login."""
         # Login
         login_data = {
             "username": test_user_data["username"],
@@ -95,12 +96,10 @@ class TestAuthEndpoints:
         assert "access_token" in data
         assert data["token_type"] == "bearer"
 
-    @pytest.mark.asyncio
-    async def test_login_with_email(self, client: AsyncClient, test_user_data: dict):
+    async def test_login_with_email(
+        self, client: AsyncClient, test_user: User, test_user_data: dict
+    ):
         """Test login using email instead of username."""
-        # Register user first
-        await client.post("/api/v1/auth/register", json=test_user_data)
-
         # Login with email
         login_data = {
             "username": test_user_data["email"],
@@ -111,14 +110,10 @@ class TestAuthEndpoints:
         assert response.status_code == 200
         assert "access_token" in response.json()
 
-    @pytest.mark.asyncio
     async def test_login_invalid_credentials(
-        self, client: AsyncClient, test_user_data: dict
+        self, client: AsyncClient, test_user: User, test_user_data: dict
     ):
         """Test login with invalid credentials."""
-        # Register user first
-        await client.post("/api/v1/auth/register", json=test_user_data)
-
         # Login with wrong password
         login_data = {
             "username": test_user_data["username"],
@@ -129,7 +124,6 @@ class TestAuthEndpoints:
         assert response.status_code == 401
         assert "incorrect" in response.json()["detail"].lower()
 
-    @pytest.mark.asyncio
     async def test_login_nonexistent_user(self, client: AsyncClient):
         """Test login with non-existent user."""
         login_data = {"username": "nonexistent", "password": "password123"}
@@ -138,7 +132,6 @@ class TestAuthEndpoints:
         assert response.status_code == 401
         assert "incorrect" in response.json()["detail"].lower()
 
-    @pytest.mark.asyncio
     async def test_get_current_user_profile(
         self, client: AsyncClient, auth_headers: dict, test_user_data: dict
     ):
@@ -152,14 +145,12 @@ class TestAuthEndpoints:
         assert "id" in data
         assert "password" not in data
 
-    @pytest.mark.asyncio
-    async def test_get_current_user_profile_unauthorized(self, client: AsyncClient):
+    async def test_get_current_user_profile_unauthorized(self, app_client: AsyncClient):
         """Test getting profile without authentication."""
-        response = await client.get("/api/v1/auth/me")
+        response = await app_client.get("/api/v1/auth/me")
 
         assert response.status_code == 401
 
-    @pytest.mark.asyncio
     async def test_get_current_user_urls_empty(
         self, client: AsyncClient, auth_headers: dict
     ):
@@ -171,9 +162,8 @@ class TestAuthEndpoints:
         assert "urls" in data
         assert len(data["urls"]) == 0
 
-    @pytest.mark.asyncio
-    async def test_get_current_user_urls_unauthorized(self, client: AsyncClient):
+    async def test_get_current_user_urls_unauthorized(self, app_client: AsyncClient):
         """Test getting user URLs without authentication."""
-        response = await client.get("/api/v1/auth/me/urls")
+        response = await app_client.get("/api/v1/auth/me/urls")
 
         assert response.status_code == 401
@@ -1,116 +1,114 @@
+import hashlib
+
 import pytest
+from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app import crud, schemas
+from app.models import URL, URLClick, User
+from app.services import cache
+from tests._helpers import FakeRedis, bulk_create_urls, count_rows
+
+USER_DATA = schemas.UserCreate(
+    username="testuser", email="test@example.com", password="TestPass123!"
+)
+URL_DATA = schemas.URLCreate(original_url="https://www.example.com")
 
 
 class TestUserCRUD:
     """Test user CRUD operations."""
 
-    @pytest.mark.asyncio
     async def test_create_user_success(self, db_session: AsyncSession):
         """Test successful user creation."""
-        user_data = schemas.UserCreate(
-            username="testuser", email="test@example.com", password="TestPass123!"
-        )
-
-        user = await crud.create_user(db_session, user_data)
+        user = await crud.create_user(db_session, USER_DATA)
 
-        assert user.username == user_data.username
-        assert user.email == user_data.email
+        assert user.username == USER_DATA.username
+        assert user.email == USER_DATA.email
         assert user.id is not None
-        assert user.hashed_password != user_data.password  # Should be hashed
-
-    @pytest.mark.asyncio
-    async def test_create_user_duplicate_username(self, db_session: AsyncSession):
-        """Test creating user with duplicate username."""
-        user_data = schemas.UserCreate(
-            username="testuser", email="test1@example.com", password="TestPass123!"
-        )
-
-        # Create first user
-        await crud.create_user(db_session, user_data)
-
-        # Try to create user with same username
-        duplicate_data = schemas.UserCreate(
-            username="testuser", email="test2@example.com", password="TestPass123!"
-        )
-
-        with pytest.raises(ValueError, match="Username already registered"):
-            await crud.create_user(db_session, duplicate_data)
-
-    @pytest.mark.asyncio
-    async def test_create_user_duplicate_email(self, db_session: AsyncSession):
-        """Test creating user with duplicate email."""
-        user_data = schemas.UserCreate(
-            username="testuser1", email="test@example.com", password="TestPass123!"
-        )
-
-        # Create first user
-        await crud.create_user(db_session, user_data)
-
-        # Try to create user with same email
+        assert user.hashed_password != USER_DATA.password  # Should be hashed
+
+    @pytest.mark.parametrize(
+        ("username", "email", "error"),
+        [
+            ("testuser", "test2@example.com", "Username already registered"),
+            ("testuser2", "test@example.com", "Email already registered"),
+        ],
+        ids=["username", "email"],
+    )
+    async def test_create_user_duplicate(
+        self,
+        db_session: AsyncSession,
+        test_user: User,
+        username: str,
+        email: str,
+        error: str,
+    ):
+        """Test creating a user whose username or email is already registered."""
         duplicate_data = schemas.UserCreate(
-            username="testuser2", email="test@example.com", password="TestPass123!"
+            username=username, email=email, password="TestPass123!"
         )
 
-        with pytest.raises(ValueError, match="Email already registered"):
+        with pytest.raises(ValueError, match=error):
             await crud.create_user(db_session, duplicate_data)
 
-    @pytest.mark.asyncio
     async def test_authenticate_user_success(self, db_session: AsyncSession):
         """Test successful user authentication."""
-        user_data = schemas.UserCreate(
-            username="testuser", email="test@example.com", password="TestPass123!"
-        )
-
         # Create user
-        created_user = await crud.create_user(db_session, user_data)
+        created_user = await crud.create_user(db_session, USER_DATA)
 
         # Authenticate with username
         authenticated_user = await crud.authenticate_user(
-            db_session, user_data.username, user_data.password
+            db_session, USER_DATA.username, USER_DATA.password
         )
 
         assert authenticated_user is not None
         assert authenticated_user.id == created_user.id
 
-    @pytest.mark.asyncio
     async def test_authenticate_user_with_email(self, db_session: AsyncSession):
         """Test user authentication with email."""
-        user_data = schemas.UserCreate(
-            username="testuser", email="test@example.com", password="TestPass123!"
-        )
-
         # Create user
-        created_user = await crud.create_user(db_session, user_data)
+        created_user = await crud.create_user(db_session, USER_DATA)
 
         # Authenticate with email
         authenticated_user = await crud.authenticate_user(
-            db_session, user_data.email, user_data.password
+            db_session, USER_DATA.email, USER_DATA.password
         )
 
         assert authenticated_user is not None
         assert authenticated_user.id == created_user.id
 
-    @pytest.mark.asyncio
-    async def test_authenticate_user_wrong_password(self, db_session: AsyncSession):
-        """Test authentication with wrong password."""
-        user_data = schemas.UserCreate(
-            username="testuser", email="test@example.com", password="TestPass123!"
+    @pytest.mark.real_crypto
+    async def test_authenticate_user_upgrades_legacy_hash(
+        self, db_session: AsyncSession
+    ):
+        """Test that a legacy pbkdf2 hash is replaced by bcrypt on login."""
+        user = await crud.create_user(db_session, USER_DATA)
+        legacy_hash = hashlib.pbkdf2_hmac(
+            "sha256", USER_DATA.password.encode(), b"salt", 1000
+        ).hex()
+        user.hashed_password = f"pbkdf2:sha256:1000$salt${legacy_hash}"
+        await db_session.commit()
+
+        authenticated_user = await crud.authenticate_user(
+            db_session, USER_DATA.username, USER_DATA.password
         )
 
+        assert authenticated_user is not None
+        assert authenticated_user.hashed_password.startswith("$2b$")
+        assert authenticated_user.check_password(USER_DATA.password)
+
+    async def test_authenticate_user_wrong_password(self, db_session: AsyncSession):
+        """Test authentication with wrong password."""
         # Create user
-        await crud.create_user(db_session, user_data)
+        await crud.create_user(db_session, USER_DATA)
 
         # Try to authenticate with wrong password
         authenticated_user = await crud.authenticate_user(
-            db_session, user_data.username, "wrongpassword"
+            db_session, USER_DATA.username, "wrongpassword"
         )
 
         assert authenticated_user is None
 
-    @pytest.mark.asyncio
     async def test_authenticate_user_nonexistent(self, db_session: AsyncSession):
         """Test authentication with non-existent user."""
         authenticated_user = await crud.authenticate_user(
@@ -119,43 +117,71 @@ class TestUserCRUD:
 
         assert authenticated_user is None
 
+    async def test_get_user_with_urls_paginated(
+        self, db_session: AsyncSession, test_user: User
+    ):
+        """Test loading a user with one page of their URLs."""
+        await bulk_create_urls(
+            db_session, [f"https://www.example{i}.com" for i in range(3)], test_user.id
+        )
+
+        user_with_urls = await crud.get_user_with_urls(
+            db_session, test_user.id, skip=1, limit=1
+        )
+
+        assert user_with_urls is not None
+        assert len(user_with_urls.urls) == 1
+        assert await crud.get_user_with_urls(db_session, 9999) is None
+
 
 class TestURLCRUD:
     """Test URL CRUD operations."""
 
-    @pytest.mark.asyncio
     async def test_create_url_success(self, db_session: AsyncSession):
         """Test successful URL creation."""
-        url_data = schemas.URLCreate(original_url="https://www.example.com")
-
-        url = await crud.create_url(db_session, url_data)
+        url = await crud.create_url(db_session, URL_DATA)
 
-        assert url.original_url == url_data.original_url
+        assert url.original_url == URL_DATA.original_url
         assert url.short_code is not None
         assert url.id is not None
         assert url.clicks == 0
 
-    @pytest.mark.asyncio
+    def test_generate_short_code_is_base62(self):
+        """Test that short codes are fixed-width base62 strings."""
+        codes = {crud.url.generate_short_code() for _ in range(100)}
+
+        assert len(codes) == 100
+        for code in codes:
+            assert len(code) == 8
+            assert set(code) <= set(crud.url.SHORT_CODE_ALPHABET)
+
     async def test_create_url_with_user(self, db_session: AsyncSession):
         """Test creating URL with user association."""
         # Create user first
-        user_data = schemas.UserCreate(
-            username="testuser", email="test@example.com", password="TestPass123!"
-        )
-        user = await crud.create_user(db_session, user_data)
+        user = await crud.create_user(db_session, USER_DATA)
 
         # Create URL with user
-        url_data = schemas.URLCreate(original_url="https://www.example.com")
-        url = await crud.create_url(db_session, url_data, user.id)
+        url = await crud.create_url(db_session, URL_DATA, user.id)
 
-        assert url.original_url == url_data.original_url
+        assert url.original_url == URL_DATA.original_url
         assert url.user_id == user.id
 
-    @pytest.mark.asyncio
+    async def test_create_url_retries_on_short_code_collision(
+        self, db_session: AsyncSession, monkeypatch: pytest.MonkeyPatch
+    ):
+        """Test that a taken short code is retried instead of raising."""
+        codes = iter(["taken123", "taken123", "free1234"])
+        monkeypatch.setattr(crud.url, "generate_short_code", lambda: next(codes))
+
+        first = await crud.create_url(db_session, URL_DATA)
+        second = await crud.create_url(db_session, URL_DATA)
+
+        assert first.short_code == "taken123"
+        assert second.short_code == "free1234"
+
     async def test_get_url_by_short_code_success(self, db_session: AsyncSession):
         """Test getting URL by short code."""
-        url_data = schemas.URLCreate(original_url="https://www.example.com")
-        created_url = await crud.create_url(db_session, url_data)
+        created_url = await crud.create_url(db_session, URL_DATA)
 
         retrieved_url = await crud.get_url_by_short_code(
             db_session, created_url.short_code
@@ -165,25 +191,70 @@ class TestURLCRUD:
         assert retrieved_url.id == created_url.id
         assert retrieved_url.short_code == created_url.short_code
 
-    @pytest.mark.asyncio
     async def test_get_url_by_short_code_not_found(self, db_session: AsyncSession):
         """Test getting non-existent URL by short code."""
         url = await crud.get_url_by_short_code(db_session, "nonexistent")
         assert url is None
 
-    @pytest.mark.asyncio
+    async def test_resolve_short_code(self, db_session: AsyncSession):
+        """Test resolving a short code to its redirect target."""
+        created_url = await crud.create_url(db_session, URL_DATA)
+
+        resolved = await crud.resolve_short_code(db_session, created_url.short_code)
+
+        assert resolved == (created_url.id, created_url.original_url)
+        assert await crud.resolve_short_code(db_session, "nonexistent") is None
+
+    async def test_resolve_short_code_after_update(self, db_session: AsyncSession):
+        """Test that updating a URL invalidates its cached redirect target."""
+        user = await crud.create_user(db_session, USER_DATA)
+        url = await crud.create_url(db_session, URL_DATA, user.id)
+        await crud.resolve_short_code(db_session, url.short_code)
+
+        new_data = schemas.URLCreate(original_url="https://www.updated.com")
+        await crud.update_url(db_session, url.id, user.id, new_data)
+
+        resolved = await crud.resolve_short_code(db_session, url.short_code)
+        assert resolved == (url.id, "https://www.updated.com")
+
+    async def test_resolve_and_count_click(self, db_session: AsyncSession):
+        """Test that a cache miss without Redis resolves and counts in one step."""
+        url = await crud.create_url(db_session, URL_DATA)
+        cache._local_urls.clear()
+
+        resolved = await crud.resolve_and_count_click(db_session, url.short_code)
+        assert resolved == (url.id, URL_DATA.original_url, True)
+
+        # Now cached, so the click is left for the caller to count
+        resolved = await crud.resolve_and_count_click(db_session, url.short_code)
+        assert resolved == (url.id, URL_DATA.original_url, False)
+
+        clicks = await db_session.scalar(select(URL.clicks).where(URL.id == url.id))
+        assert clicks == 1
+        assert await crud.resolve_and_count_click(db_session, "nonexistent") is None
+
+    async def test_resolve_and_count_click_with_redis(
+        self, db_session: AsyncSession, fake_redis: FakeRedis
+    ):
+        """Test that clicks are left to the Redis buffer when it is configured."""
+        url = await crud.create_url(db_session, URL_DATA)
+        cache._local_urls.clear()
+
+        resolved = await crud.resolve_and_count_click(db_session, url.short_code)
+
+        assert resolved == (url.id, URL_DATA.original_url, False)
+        clicks = await db_session.scalar(select(URL.clicks).where(URL.id == url.id))
+        assert clicks == 0
+
     async def test_get_urls_by_user(self, db_session: AsyncSession):
         """Test getting URLs by user."""
         # Create user
-        user_data = schemas.UserCreate(
-            username="testuser", email="test@example.com", password="TestPass123!"
-        )
-        user = await crud.create_user(db_session, user_data)
+        user = await crud.create_user(db_session, USER_DATA)
 
         # Create URLs for user
-        for i in range(3):
-            url_data = schemas.URLCreate(original_url=f"https://www.example{i}.com")
-            await crud.create_url(db_session, url_data, user.id)
+        await bulk_create_urls(
+            db_session, [f"https://www.example{i}.com" for i in range(3)], user.id
+        )
 
         # Get user URLs
         urls = await crud.get_urls_by_user(db_session, user.id)
@@ -192,35 +263,42 @@ class TestURLCRUD:
         for url in urls:
             assert url.user_id == user.id
 
-    @pytest.mark.asyncio
     async def test_increment_click_count(self, db_session: AsyncSession):
         """Test incrementing URL click count."""
-        url_data = schemas.URLCreate(original_url="https://www.example.com")
-        url = await crud.create_url(db_session, url_data)
+        url = await crud.create_url(db_session, URL_DATA)
 
         initial_clicks = url.clicks
         assert initial_clicks == 0
 
         # Increment clicks
-        await crud.increment_click_count(db_session, url.short_code)
+        assert await crud.increment_click_count(db_session, url.short_code)
+        assert not await crud.increment_click_count(db_session, "nonexistent")
 
         # Get updated URL
         updated_url = await crud.get_url_by_short_code(db_session, url.short_code)
         assert updated_url is not None
         assert updated_url.clicks == 1
 
-    @pytest.mark.asyncio
+    async def test_add_click_counts(self, db_session: AsyncSession):
+        """Test applying buffered click deltas to several URLs at once."""
+        first = await crud.create_url(db_session, URL_DATA)
+        second = await crud.create_url(db_session, URL_DATA)
+
+        updated = await crud.add_click_counts(db_session, {first.id: 3, second.id: 1})
+
+        assert updated == 2
+        await db_session.refresh(first)
+        await db_session.refresh(second)
+        assert first.clicks == 3
+        assert second.clicks == 1
+
     async def test_update_url_success(self, db_session: AsyncSession):
         """Test updating URL."""
         # Create user
-        user_data = schemas.UserCreate(
-            username="testuser", email="test@example.com", password="TestPass123!"
-        )
-        user = await crud.create_user(db_session, user_data)
+        user = await crud.create_user(db_session, USER_DATA)
 
         # Create URL
-        url_data = schemas.URLCreate(original_url="https://www.example.com")
-        url = await crud.create_url(db_session, url_data, user.id)
+        url = await crud.create_url(db_session, URL_DATA, user.id)
 
         # Update URL
         updated_data = schemas.URLCreate(original_url="https://www.updated.com")
@@ -229,7 +307,6 @@ class TestURLCRUD:
         assert updated_url is not None
         assert updated_url.original_url == updated_data.original_url
 
-    @pytest.mark.asyncio
     async def test_update_url_not_found(self, db_session: AsyncSession):
         """Test updating non-existent URL."""
         updated_data = schemas.URLCreate(original_url="https://www.updated.com")
@@ -237,29 +314,24 @@ class TestURLCRUD:
 
         assert updated_url is None
 
-    @pytest.mark.asyncio
     async def test_delete_url_by_user_success(self, db_session: AsyncSession):
         """Test deleting URL by user."""
         # Create user
-        user_data = schemas.UserCreate(
-            username="testuser", email="test@example.com", password="TestPass123!"
-        )
-        user = await crud.create_user(db_session, user_data)
+        user = await crud.create_user(db_session, USER_DATA)
 
         # Create URL
-        url_data = schemas.URLCreate(original_url="https://www.example.com")
-        url = await crud.create_url(db_session, url_data, user.id)
+        url = await crud.create_url(db_session, URL_DATA, user.id)
+        await crud.create_click_analytics(db=db_session, url_id=url.id)
 
         # Delete URL
         success = await crud.delete_url_by_user(db_session, url.id, user.id)
 
         assert success is True
 
-        # Verify URL is deleted
-        deleted_url = await crud.get_url_by_short_code(db_session, url.short_code)
-        assert deleted_url is None
+        # Verify URL and its clicks are deleted
+        assert await count_rows(db_session, URL, URL.id == url.id) == 0
+        assert await count_rows(db_session, URLClick, URLClick.url_id == url.id) == 0
 
-    @pytest.mark.asyncio
     async def test_delete_url_by_user_not_found(self, db_session: AsyncSession):
         """Test deleting non-existent URL by user."""
         success = await crud.delete_url_by_user(db_session, 999, 1)
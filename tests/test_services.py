@@ -0,0 +1,366 @@
+import asyncio
+from contextlib import suppress
+from datetime import UTC, datetime, timedelta
+
+import pytest
+from httpx import AsyncClient
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app import crud
+from app.models import URL, URLClick, URLClickDailyStats
+from app.services import analytics_rollup, cache, click_counter, click_queue
+from tests._helpers import FakeRedis, count_rows
+
+
+def _click(url: URL, i: int = 0) -> dict:
+    return {"url_id": url.id, "ip_address": f"192.168.1.{i}"}
+
+
+async def _clicks(db: AsyncSession, url: URL) -> int:
+    return await db.scalar(select(URL.clicks).where(URL.id == url.id))
+
+
+class TestClickQueue:
+    """Test the batched background click writer."""
+
+    async def test_enqueue_click_writer_not_running(
+        self, monkeypatch: pytest.MonkeyPatch, short_url: URL
+    ):
+        """Test that clicks are dropped while no writer is running."""
+        monkeypatch.setattr(click_queue, "_click_queue", None)
+
+        assert click_queue.enqueue_click(_click(short_url)) is False
+
+    async def test_enqueue_click_queue_full(
+        self, monkeypatch: pytest.MonkeyPatch, short_url: URL
+    ):
+        """Test that clicks beyond the queue's capacity are dropped."""
+        queue: asyncio.Queue = asyncio.Queue(maxsize=1)
+        monkeypatch.setattr(click_queue, "_click_queue", queue)
+
+        assert click_queue.enqueue_click(_click(short_url, 1)) is True
+        assert click_queue.enqueue_click(_click(short_url, 2)) is False
+        assert queue.qsize() == 1
+
+    async def test_flush_clicks(
+        self,
+        db_session: AsyncSession,
+        db_session_factory: async_sessionmaker[AsyncSession],
+        queued_clicks: asyncio.Queue,
+        short_url: URL,
+    ):
+        """Test that flushing writes every queued click and stops accepting more."""
+        for i in range(3):
+            assert click_queue.enqueue_click(_click(short_url, i)) is True
+
+        await click_queue.flush_clicks(db_session_factory, batch_size=2)
+
+        assert queued_clicks.empty()
+        assert await count_rows(db_session, URLClick) == 3
+        assert click_queue.enqueue_click(_click(short_url)) is False
+
+    async def test_flush_clicks_failed_batch(
+        self,
+        db_session: AsyncSession,
+        db_session_factory: async_sessionmaker[AsyncSession],
+        queued_clicks: asyncio.Queue,
+        short_url: URL,
+    ):
+        """Test that a batch failing to write is dropped and later batches are kept."""
+        calls = 0
+
+        def flaky_factory() -> AsyncSession:
+            nonlocal calls
+            calls += 1
+            if calls == 1:
+                raise RuntimeError("database unavailable")
+            return db_session_factory()
+
+        for i in range(3):
+            click_queue.enqueue_click(_click(short_url, i))
+
+        await click_queue.flush_clicks(flaky_factory, batch_size=2)
+
+        assert queued_clicks.empty()
+        result = await db_session.execute(select(URLClick.ip_address))
+        assert result.scalars().all() == ["192.168.1.2"]
+
+    async def test_run_click_writer(
+        self,
+        db_session: AsyncSession,
+        db_session_factory: async_sessionmaker[AsyncSession],
+        monkeypatch: pytest.MonkeyPatch,
+        short_url: URL,
+    ):
+        """Test that the writer writes full batches and flushes partial ones."""
+        monkeypatch.setattr(click_queue, "_click_queue", None)
+        writer = asyncio.create_task(
+            click_queue.run_click_writer(
+                db_session_factory, batch_size=2, flush_interval=0.01
+            )
+        )
+        await asyncio.sleep(0)
+
+        for i in range(3):
+            assert click_queue.enqueue_click(_click(short_url, i)) is True
+        # One full batch right away, then the leftover click after flush_interval
+        await asyncio.sleep(0.1)
+
+        assert await count_rows(db_session, URLClick) == 3
+
+        writer.cancel()
+        with suppress(asyncio.CancelledError):
+            await writer
+
+    async def test_run_click_writer_flushes_on_cancel(
+        self,
+        db_session: AsyncSession,
+        db_session_factory: async_sessionmaker[AsyncSession],
+        monkeypatch: pytest.MonkeyPatch,
+        short_url: URL,
+    ):
+        """Test that cancelling the writer still writes its half-filled batch."""
+        monkeypatch.setattr(click_queue, "_click_queue", None)
+        writer = asyncio.create_task(
+            click_queue.run_click_writer(db_session_factory, flush_interval=60)
+        )
+        await asyncio.sleep(0)
+
+        click_queue.enqueue_click(_click(short_url))
+        await asyncio.sleep(0)
+        writer.cancel()
+        with suppress(asyncio.CancelledError):
+            await writer
+
+        assert await count_rows(db_session, URLClick) == 1
+
+
+class TestClickCounter:
+    """Test the Redis-buffered click counter."""
+
+    async def test_bump_without_redis(
+        self,
+        db_session: AsyncSession,
+        db_session_factory: async_sessionmaker[AsyncSession],
+        short_url: URL,
+    ):
+        """Test that clicks are written straight to the database without Redis."""
+        await click_counter.bump(short_url.id, db_session_factory)
+
+        assert await _clicks(db_session, short_url) == 1
+        assert await click_counter.pending_click_count(short_url.id) == 0
+        assert await click_counter.flush_click_counts() == 0
+
+    async def test_bump_and_flush(
+        self,
+        db_session: AsyncSession,
+        db_session_factory: async_sessionmaker[AsyncSession],
+        fake_redis: FakeRedis,
+        short_url: URL,
+    ):
+        """Test that buffered bumps reach urls.clicks in one flush."""
+        for _ in range(3):
+            await click_counter.bump(short_url.id, db_session_factory)
+
+        assert await _clicks(db_session, short_url) == 0
+        assert await click_counter.pending_click_count(short_url.id) == 3
+
+        assert await click_counter.flush_click_counts(db_session_factory) == 1
+        assert await _clicks(db_session, short_url) == 3
+        assert await click_counter.pending_click_count(short_url.id) == 0
+        # Nothing left to flush, so the counts are not applied twice
+        assert await click_counter.flush_click_counts(db_session_factory) == 0
+        assert await _clicks(db_session, short_url) == 3
+
+    async def test_flush_failure_restores_counts(
+        self,
+        db_session: AsyncSession,
+        db_session_factory: async_sessionmaker[AsyncSession],
+        fake_redis: FakeRedis,
+        short_url: URL,
+    ):
+        """Test that counts taken out for a failed flush are put back."""
+        for _ in range(2):
+            await click_counter.bump(short_url.id, db_session_factory)
+        # A click arriving during the failed flush must not be lost either
+        await fake_redis.incr(f"c:{short_url.id}")
+
+        def broken_factory() -> AsyncSession:
+            raise RuntimeError("database unavailable")
+
+        with pytest.raises(RuntimeError):
+            await click_counter.flush_click_counts(broken_factory)
+
+        assert await click_counter.pending_click_count(short_url.id) == 3
+        assert await _clicks(db_session, short_url) == 0
+
+    async def test_bump_falls_back_when_redis_fails(
+        self,
+        db_session: AsyncSession,
+        db_session_factory: async_sessionmaker[AsyncSession],
+        fake_redis: FakeRedis,
+        monkeypatch: pytest.MonkeyPatch,
+        short_url: URL,
+    ):
+        """Test that a click is written to the database if Redis errors."""
+
+        async def broken_incr(key: str) -> int:
+            raise ConnectionError("redis unavailable")
+
+        monkeypatch.setattr(fake_redis, "incr", broken_incr)
+
+        await click_counter.bump(short_url.id, db_session_factory)
+
+        assert await _clicks(db_session, short_url) == 1
+
+    async def test_stats_include_pending_clicks(
+        self,
+        client: AsyncClient,
+        db_session: AsyncSession,
+        db_session_factory: async_sessionmaker[AsyncSession],
+        fake_redis: FakeRedis,
+        short_url: URL,
+    ):
+        """Test that the stats route adds clicks still buffered in Redis."""
+        await crud.add_click_counts(db_session, {short_url.id: 1})
+        for _ in range(2):
+            await click_counter.bump(short_url.id, db_session_factory)
+
+        response = await client.get(f"/api/v1/stats/{short_url.short_code}")
+
+        assert response.status_code == 200
+        assert response.json()["clicks"] == 3
+
+
+class TestURLCache:
+    """Test the redirect cache and its cross-worker invalidation."""
+
+    def test_ttl_cache_expiry(self):
+        """Test that entries are served until their TTL passes."""
+        clock = [100.0]
+        local = cache.TTLCache(maxsize=10, ttl=5, clock=lambda: clock[0])
+        local.set("abc", "https://www.example.com")
+
+        clock[0] = 105.0
+        assert local.get("abc") == "https://www.example.com"
+        clock[0] = 105.1
+        assert local.get("abc") is None
+
+    def test_ttl_cache_eviction(self):
+        """Test that the least recently used entry is evicted at capacity."""
+        local = cache.TTLCache(maxsize=2, ttl=60)
+        local.set("a", 1)
+        local.set("b", 2)
+        assert local.get("a") == 1
+
+        local.set("c", 3)
+
+        assert local.get("b") is None
+        assert (local.get("a"), local.get("c")) == (1, 3)
+
+    def test_ttl_cache_disabled(self):
+        """Test that a cache of size 0 stores nothing."""
+        local = cache.TTLCache(maxsize=0, ttl=60)
+        local.set("a", 1)
+
+        assert local.get("a") is None
+
+    async def test_cached_url_round_trip(self, fake_redis: FakeRedis):
+        """Test that a Redis hit refills the local cache and invalidation clears both."""
+        await cache.cache_url("abc", 1, "https://www.example.com")
+        cache._local_urls.clear()
+
+        cached = await cache.get_cached_url("abc")
+
+        assert cached == {"id": 1, "original_url": "https://www.example.com"}
+        assert cache._local_urls.get("abc") == cached
+
+        await cache.invalidate_url("abc")
+
+        assert await cache.get_cached_url("abc") is None
+        assert "u:abc" not in fake_redis.data
+
+    async def test_invalidation_listener(self, fake_redis: FakeRedis):
+        """Test that an invalidation from another worker evicts the local entry."""
+        cache._local_urls.set("abc", {"id": 1, "original_url": "https://a.example"})
+        cache._local_urls.set("xyz", {"id": 2, "original_url": "https://b.example"})
+        listener = asyncio.create_task(cache.run_invalidation_listener())
+        try:
+            while not fake_redis.subscribers:
+                await asyncio.sleep(0)
+
+            await fake_redis.publish(cache.INVALIDATION_CHANNEL, "abc")
+            await asyncio.sleep(0.01)
+
+            assert cache._local_urls.get("abc") is None
+            assert cache._local_urls.get("xyz") is not None
+        finally:
+            listener.cancel()
+            with suppress(asyncio.CancelledError):
+                await listener
+            cache._local_urls.clear()
+
+    async def test_invalidation_listener_clears_on_error(
+        self, fake_redis: FakeRedis, monkeypatch: pytest.MonkeyPatch
+    ):
+        """Test that losing the subscription drops every local entry."""
+
+        def broken_pubsub():
+            raise ConnectionError("redis unavailable")
+
+        monkeypatch.setattr(fake_redis, "pubsub", broken_pubsub)
+        cache._local_urls.set("abc", {"id": 1, "original_url": "https://a.example"})
+        listener = asyncio.create_task(
+            cache.run_invalidation_listener(retry_interval=60)
+        )
+        await asyncio.sleep(0)
+
+        assert cache._local_urls.get("abc") is None
+
+        listener.cancel()
+        with suppress(asyncio.CancelledError):
+            await listener
+
+
+class TestAnalyticsRollup:
+    """Test the periodic daily click rollup."""
+
+    async def test_run_daily_rollup(
+        self,
+        db_session: AsyncSession,
+        db_session_factory: async_sessionmaker[AsyncSession],
+        short_url: URL,
+    ):
+        """Test that a rollup pass folds closed days into the daily stats."""
+        two_days_ago = datetime.now(UTC) - timedelta(days=2)
+        db_session.add(URLClick(url_id=short_url.id, clicked_at=two_days_ago))
+        await db_session.commit()
+
+        rollup = asyncio.create_task(
+            analytics_rollup.run_daily_rollup(db_session_factory, interval=60)
+        )
+        await asyncio.sleep(0.1)
+        rollup.cancel()
+        with suppress(asyncio.CancelledError):
+            await rollup
+
+        assert await count_rows(db_session, URLClickDailyStats) == 1
+
+    async def test_run_daily_rollup_survives_errors(self):
+        """Test that a failed pass is logged and retried on the next tick."""
+        calls = 0
+
+        def broken_factory() -> AsyncSession:
+            nonlocal calls
+            calls += 1
+            raise RuntimeError("database unavailable")
+
+        rollup = asyncio.create_task(
+            analytics_rollup.run_daily_rollup(broken_factory, interval=0)
+        )
+        while calls < 2:
+            await asyncio.sleep(0)
+        rollup.cancel()
+        with suppress(asyncio.CancelledError):
+            await rollup
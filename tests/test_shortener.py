@@ -1,12 +1,17 @@
+import asyncio
+
 from httpx import AsyncClient
-import pytest
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app.models import URL, URLClick, User
+from app.services.click_queue import flush_clicks
+from tests._helpers import bulk_create_urls, count_rows
 
 
 class TestShortenerEndpoints:
     """Test URL shortener endpoints."""
 
-    @pytest.mark.asyncio
-
     async def test_create_short_url_success(
         self, client: AsyncClient, test_url_data: dict
     ):
@@ -20,24 +25,21 @@ class TestShortenerEndpoints:
         assert "id" in data
         assert data["clicks"] == 0
 
-    @pytest.mark.asyncio
-
-    async def test_create_short_url_invalid_url(self, client: AsyncClient):
+    async def test_create_short_url_invalid_url(self, app_client: AsyncClient):
         """Test URL shortening with invalid URL."""
         invalid_data = {"original_url": "invalid-url"}
-        response = await client.post("/api/v1/shorten", json=invalid_data)
+        response = await app_client.post("/api/v1/shorten", json=invalid_data)
 
         assert response.status_code == 422  # Validation error
 
-    @pytest.mark.asyncio
-
     async def test_redirect_to_url_success(
-        self, client: AsyncClient, test_url_data: dict
+        self,
+        client: AsyncClient,
+        short_url: URL,
+        test_url_data: dict,
     ):
         """Test successful URL redirect."""
-        # Create short URL first
-        create_response = await client.post("/api/v1/shorten", json=test_url_data)
-        short_code = create_response.json()["short_code"]
+        short_code = short_url.short_code
 
         # Test redirect
         response = await client.get(f"/api/v1/{short_code}")
@@ -45,8 +47,6 @@ class TestShortenerEndpoints:
         assert response.status_code == 302  # Redirect status
         assert response.headers["location"] == test_url_data["original_url"]
 
-    @pytest.mark.asyncio
-
     async def test_redirect_to_url_not_found(self, client: AsyncClient):
         """Test redirect with non-existent short code."""
         response = await client.get("/api/v1/nonexistent")
@@ -54,15 +54,36 @@ class TestShortenerEndpoints:
         assert response.status_code == 404
         assert "not found" in response.json()["detail"].lower()
 
-    @pytest.mark.asyncio
+    async def test_redirect_records_click(
+        self,
+        client: AsyncClient,
+        db_session: AsyncSession,
+        db_session_factory: async_sessionmaker[AsyncSession],
+        queued_clicks: asyncio.Queue,
+        short_url: URL,
+    ):
+        """Test that a redirect ends up as a click row once the writer flushes."""
+        await client.get(
+            f"/api/v1/{short_url.short_code}",
+            headers={"referer": "https://www.google.com"},
+        )
+        await flush_clicks(db_session_factory)
+
+        result = await db_session.execute(
+            select(URLClick).where(URLClick.url_id == short_url.id)
+        )
+        clicks = result.scalars().all()
+        assert len(clicks) == 1
+        assert clicks[0].referrer == "https://www.google.com"
 
     async def test_get_url_stats_success(
-        self, client: AsyncClient, test_url_data: dict
+        self,
+        client: AsyncClient,
+        short_url: URL,
+        test_url_data: dict,
     ):
         """Test getting URL statistics."""
-        # Create short URL first
-        create_response = await client.post("/api/v1/shorten", json=test_url_data)
-        short_code = create_response.json()["short_code"]
+        short_code = short_url.short_code
 
         # Get stats
         response = await client.get(f"/api/v1/stats/{short_code}")
@@ -73,8 +94,6 @@ class TestShortenerEndpoints:
         assert data["short_code"] == short_code
         assert data["clicks"] == 0
 
-    @pytest.mark.asyncio
-
     async def test_get_url_stats_not_found(self, client: AsyncClient):
         """Test getting stats for non-existent URL."""
         response = await client.get("/api/v1/stats/nonexistent")
@@ -82,15 +101,14 @@ class TestShortenerEndpoints:
         assert response.status_code == 404
         assert "not found" in response.json()["detail"].lower()
 
-    @pytest.mark.asyncio
-
     async def test_get_url_analytics_success(
-        self, client: AsyncClient, test_url_data: dict
+        self,
+        client: AsyncClient,
+        short_url: URL,
+        test_url_data: dict,
     ):
         """Test getting URL analytics."""
-        # Create short URL first
-        create_response = await client.post("/api/v1/shorten", json=test_url_data)
-        short_code = create_response.json()["short_code"]
+        short_code = short_url.short_code
 
         # Get analytics
         response = await client.get(f"/api/v1/analytics/{short_code}")
@@ -102,8 +120,6 @@ class TestShortenerEndpoints:
         assert "device_breakdown" in data
         assert "browser_breakdown" in data
 
-    @pytest.mark.asyncio
-
     async def test_get_url_analytics_not_found(self, client: AsyncClient):
         """Test getting analytics for non-existent URL."""
         response = await client.get("/api/v1/analytics/nonexistent")
@@ -111,8 +127,6 @@ class TestShortenerEndpoints:
         assert response.status_code == 404
         assert "not found" in response.json()["detail"].lower()
 
-    @pytest.mark.asyncio
-
     async def test_get_global_analytics(self, client: AsyncClient):
         """Test getting global analytics."""
         response = await client.get("/api/v1/analytics/global")
@@ -124,15 +138,15 @@ class TestShortenerEndpoints:
         assert "device_breakdown" in data
         assert "browser_breakdown" in data
 
-    @pytest.mark.asyncio
-
     async def test_redirect_increments_clicks(
-        self, client: AsyncClient, test_url_data: dict
+        self,
+        client: AsyncClient,
+        db_session: AsyncSession,
+        short_url: URL,
+        test_url_data: dict,
     ):
         """Test that redirect increments click count."""
-        # Create short URL first
-        create_response = await client.post("/api/v1/shorten", json=test_url_data)
-        short_code = create_response.json()["short_code"]
+        short_code = short_url.short_code
 
         # Initial stats
         stats_response = await client.get(f"/api/v1/stats/{short_code}")
@@ -141,6 +155,9 @@ class TestShortenerEndpoints:
 
         # Perform redirect
         await client.get(f"/api/v1/{short_code}")
+        # The count is written by the background task's own session; forget the
+        # stale row, as a fresh request session would
+        db_session.expire_all()
 
         # Check stats again
         stats_response = await client.get(f"/api/v1/stats/{short_code}")
@@ -151,8 +168,6 @@ class TestShortenerEndpoints:
 class TestUserShortenerEndpoints:
     """Test user-specific URL shortener endpoints."""
 
-    @pytest.mark.asyncio
-
     async def test_create_user_short_url_success(
         self, client: AsyncClient, auth_headers: dict, test_url_data: dict
     ):
@@ -168,18 +183,14 @@ class TestUserShortenerEndpoints:
         assert "id" in data
         assert data["clicks"] == 0
 
-    @pytest.mark.asyncio
-
     async def test_create_user_short_url_unauthorized(
-        self, client: AsyncClient, test_url_data: dict
+        self, app_client: AsyncClient, test_url_data: dict
     ):
         """Test creating user short URL without authentication."""
-        response = await client.post("/api/v1/user/shorten", json=test_url_data)
+        response = await app_client.post("/api/v1/user/shorten", json=test_url_data)
 
         assert response.status_code == 401
 
-    @pytest.mark.asyncio
-
     async def test_get_user_urls_empty(self, client: AsyncClient, auth_headers: dict):
         """Test getting user URLs when user has none."""
         response = await client.get("/api/v1/user/urls", headers=auth_headers)
@@ -188,17 +199,14 @@ class TestUserShortenerEndpoints:
         assert isinstance(response.json(), list)
         assert len(response.json()) == 0
 
-    @pytest.mark.asyncio
-
     async def test_get_user_urls_with_data(
-        self, client: AsyncClient, auth_headers: dict, test_url_data: dict
+        self,
+        client: AsyncClient,
+        auth_headers: dict,
+        user_short_url: URL,
+        test_url_data: dict,
     ):
         """Test getting user URLs when user has created URLs."""
-        # Create a short URL first
-        await client.post(
-            "/api/v1/user/shorten", json=test_url_data, headers=auth_headers
-        )
-
         # Get user URLs
         response = await client.get("/api/v1/user/urls", headers=auth_headers)
 
@@ -207,25 +215,21 @@ class TestUserShortenerEndpoints:
         assert len(urls) == 1
         assert urls[0]["original_url"] == test_url_data["original_url"]
 
-    @pytest.mark.asyncio
-
-    async def test_get_user_urls_unauthorized(self, client: AsyncClient):
+    async def test_get_user_urls_unauthorized(self, app_client: AsyncClient):
         """Test getting user URLs without authentication."""
-        response = await client.get("/api/v1/user/urls")
+        response = await app_client.get("/api/v1/user/urls")
 
         assert response.status_code == 401
 
-    @pytest.mark.asyncio
-
     async def test_get_user_url_by_id_success(
-        self, client: AsyncClient, auth_headers: dict, test_url_data: dict
+        self,
+        client: AsyncClient,
+        auth_headers: dict,
+        user_short_url: URL,
+        test_url_data: dict,
     ):
         """Test getting user URL by ID."""
-        # Create a short URL first
-        create_response = await client.post(
-            "/api/v1/user/shorten", json=test_url_data, headers=auth_headers
-        )
-        url_id = create_response.json()["id"]
+        url_id = user_short_url.id
 
         # Get URL by ID
         response = await client.get(f"/api/v1/user/urls/{url_id}", headers=auth_headers)
@@ -235,8 +239,6 @@ class TestUserShortenerEndpoints:
         assert data["id"] == url_id
         assert data["original_url"] == test_url_data["original_url"]
 
-    @pytest.mark.asyncio
-
     async def test_get_user_url_by_id_not_found(
         self, client: AsyncClient, auth_headers: dict
     ):
@@ -246,25 +248,21 @@ class TestUserShortenerEndpoints:
         assert response.status_code == 404
         assert "not found" in response.json()["detail"].lower()
 
-    @pytest.mark.asyncio
-
-    async def test_get_user_url_by_id_unauthorized(self, client: AsyncClient):
+    async def test_get_user_url_by_id_unauthorized(self, app_client: AsyncClient):
         """Test getting user URL by ID without authentication."""
-        response = await client.get("/api/v1/user/urls/1")
+        response = await app_client.get("/api/v1/user/urls/1")
 
         assert response.status_code == 401
 
-    @pytest.mark.asyncio
-
     async def test_update_user_url_success(
-        self, client: AsyncClient, auth_headers: dict, test_url_data: dict
+        self,
+        client: AsyncClient,
+        auth_headers: dict,
+        user_short_url: URL,
+        test_url_data: dict,
     ):
         """Test updating user URL."""
-        # Create a short URL first
-        create_response = await client.post(
-            "/api/v1/user/shorten", json=test_url_data, headers=auth_headers
-        )
-        url_id = create_response.json()["id"]
+        url_id = user_short_url.id
 
         # Update URL
         updated_data = {"original_url": "https://www.updated-example.com"}
@@ -277,8 +275,6 @@ class TestUserShortenerEndpoints:
         assert data["id"] == url_id
         assert data["original_url"] == updated_data["original_url"]
 
-    @pytest.mark.asyncio
-
     async def test_update_user_url_not_found(
         self, client: AsyncClient, auth_headers: dict
     ):
@@ -291,27 +287,24 @@ class TestUserShortenerEndpoints:
         assert response.status_code == 404
         assert "not found" in response.json()["detail"].lower()
 
-    @pytest.mark.asyncio
-
     async def test_update_user_url_unauthorized(
-        self, client: AsyncClient, test_url_data: dict
+        self, app_client: AsyncClient, test_url_data: dict
     ):
         """Test updating user URL without authentication."""
-        response = await client.put("/api/v1/user/urls/1", json=test_url_data)
+        response = await app_client.put("/api/v1/user/urls/1", json=test_url_data)
 
         assert response.status_code == 401
 
-    @pytest.mark.asyncio
-
     async def test_delete_user_url_success(
-        self, client: AsyncClient, auth_headers: dict, test_url_data: dict
+        self,
+        client: AsyncClient,
+        db_session: AsyncSession,
+        auth_headers: dict,
+        user_short_url: URL,
+        test_url_data: dict,
     ):
         """Test deleting user URL."""
-        # Create a short URL first
-        create_response = await client.post(
-            "/api/v1/user/shorten", json=test_url_data, headers=auth_headers
-        )
-        url_id = create_response.json()["id"]
+        url_id = user_short_url.id
 
         # Delete URL
         response = await client.delete(
@@ -321,12 +314,7 @@ class TestUserShortenerEndpoints:
         assert response.status_code == 204
 
         # Verify URL is deleted
-        get_response = await client.get(
-            f"/api/v1/user/urls/{url_id}", headers=auth_headers
-        )
-        assert get_response.status_code == 404
-
-    @pytest.mark.asyncio
+        assert await count_rows(db_session, URL, URL.id == url_id) == 0
 
     async def test_delete_user_url_not_found(
         self, client: AsyncClient, auth_headers: dict
@@ -337,26 +325,30 @@ class TestUserShortenerEndpoints:
         assert response.status_code == 404
         assert "not found" in response.json()["detail"].lower()
 
-    @pytest.mark.asyncio
-
-    async def test_delete_user_url_unauthorized(self, client: AsyncClient):
+    async def test_delete_user_url_unauthorized(self, app_client: AsyncClient):
         """Test deleting user URL without authentication."""
-        response = await client.delete("/api/v1/user/urls/1")
+        response = await app_client.delete("/api/v1/user/urls/1")
 
         assert response.status_code == 401
 
-    @pytest.mark.asyncio
-
     async def test_user_urls_pagination(
-        self, client: AsyncClient, auth_headers: dict, test_url_data: dict
+        self,
+        client: AsyncClient,
+        db_session: AsyncSession,
+        test_user: User,
+        auth_headers: dict,
+        test_url_data: dict,
     ):
         """Test user URLs pagination."""
-        # Create multiple URLs
-        for i in range(5):
-            url_data = {"original_url": f"https://www.example{i}.com"}
-            await client.post(
-                "/api/v1/user/shorten", json=url_data, headers=auth_headers
-            )
+        # Create multiple URLs, one through the API and the rest directly
+        await client.post(
+            "/api/v1/user/shorten", json=test_url_data, headers=auth_headers
+        )
+        await bulk_create_urls(
+            db_session,
+            [f"https://www.example{i}.com" for i in range(4)],
+            test_user.id,
+        )
 
         # Test pagination
         response = await client.get(
@@ -366,3 +358,19 @@ class TestUserShortenerEndpoints:
         assert response.status_code == 200
         urls = response.json()
         assert len(urls) == 2
+
+
+class TestErrorHandling:
+    """Test responses for unexpected server errors."""
+
+    async def test_unhandled_exception_returns_generic_500(
+        self, failing_db_client: AsyncClient
+    ):
+        """Test that an unexpected error becomes a JSON 500 without its details."""
+        response = await failing_db_client.get("/api/v1/stats/abc123")
+
+        assert response.status_code == 500
+        assert response.headers["content-type"] == "application/json"
+        assert response.json() == {"detail": "Internal server error"}
+        assert "db-internal" not in response.text
+        assert "Traceback" not in response.text